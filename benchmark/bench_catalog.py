@@ -0,0 +1,84 @@
+"""Compares listing a large directory tree with `Path` objects and with the
+segment catalog.
+
+    python3 benchmark/bench_catalog.py [--segments 1000000] [--subdirs 2]
+
+The tree is made of empty files, since only their names are read. For
+each way of listing it prints the time and the memory taken by the result.
+"""
+
+import argparse
+import gc
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# pylint: disable=wrong-import-position
+from linecompress._catalog import SegmentCatalog, iter_segments
+from linecompress._dir import NumberedFilePath, _split_nums
+from linecompress._search_last import _recurse_paths
+
+
+def create_tree(root: Path, segments: int, subdirs: int):
+    for num in range(segments):
+        file = NumberedFilePath(root, _split_nums(num, length=subdirs + 1),
+                                '.txt.gz' if num < segments - 1
+                                else '.txt').path
+        if num % 1000 == 0:
+            file.parent.mkdir(parents=True, exist_ok=True)
+        file.touch()
+
+
+def path_objects(root: Path, subdirs: int) -> Any:
+    return [NumberedFilePath.from_path(p, subdirs=subdirs)
+            for p in _recurse_paths(root, reverse=False, go_deeper=subdirs)]
+
+
+def segment_objects(root: Path, subdirs: int) -> Any:
+    return list(iter_segments(root, subdirs))
+
+
+def catalog(root: Path, subdirs: int) -> Any:
+    return SegmentCatalog.scan(root, subdirs)
+
+
+def measure(name: str, func: Callable[[Path, int], Any], root: Path,
+            subdirs: int):
+    gc.collect()
+    started = time.perf_counter()
+    result = func(root, subdirs)
+    elapsed = time.perf_counter() - started
+    del result
+    gc.collect()
+    # the memory is measured in a separate run, since tracing is slow
+    tracemalloc.start()
+    result = func(root, subdirs)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:>10}: {len(result):,} files  {elapsed:.2f} s  '
+          f'{size / 1e6:.1f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--segments', type=int, default=1000 * 1000)
+    parser.add_argument('--subdirs', type=int, default=2)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tds:
+        root = Path(tds)
+        started = time.perf_counter()
+        create_tree(root, args.segments, args.subdirs)
+        print(f'created {args.segments:,} files in '
+              f'{time.perf_counter() - started:.1f} s')
+        measure('paths', path_objects, root, args.subdirs)
+        measure('segments', segment_objects, root, args.subdirs)
+        measure('catalog', catalog, root, args.subdirs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Compares the codecs by compression ratio and speed.
+
+    python3 benchmark/bench_codecs.py [sample.txt]
+
+Without an argument, synthetic timestamped log lines are used.
+"""
+
+import io
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# pylint: disable=wrong-import-position
+from linecompress import Codec, GzipCodec, LzmaCodec, Bz2Codec, ZstdCodec, \
+    Lz4Codec
+
+
+def synthetic_lines(count: int) -> List[str]:
+    rnd = random.Random(0)
+    levels = ['DEBUG', 'INFO', 'INFO', 'INFO', 'WARNING', 'ERROR']
+    words = ['request', 'user', 'session', 'cache', 'timeout', 'retry',
+             'database', 'query', 'ok', 'failed', 'connection', 'id']
+    ts = 1600000000.0
+    result = []
+    for _ in range(count):
+        ts += rnd.expovariate(10)
+        message = ' '.join(rnd.choice(words)
+                           for _ in range(rnd.randint(3, 12)))
+        result.append(f'{ts:.3f} {rnd.choice(levels)} '
+                      f'{rnd.getrandbits(64):016x} {message}')
+    return result
+
+
+def codecs() -> List[Codec]:
+    result: List[Codec] = []
+    for level in [1, 6, 9]:
+        result.append(GzipCodec(level=level))
+    for level in [0, 6]:
+        result.append(LzmaCodec(level=level))
+    result.append(Bz2Codec(level=9))
+    for codec_type, levels in [(ZstdCodec, [1, 3, 19]), (Lz4Codec, [0, 9])]:
+        try:
+            result.extend(codec_type(level=level) for level in levels)
+        except ImportError:
+            print(f'{codec_type.__name__} is not available')
+    return result
+
+
+def measure(codec: Codec, data: bytes):
+    started = time.perf_counter()
+    compressed = codec.compress(data)
+    compress_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with codec.reader(io.BytesIO(compressed)) as f:  # type: ignore
+        restored = f.read()
+    decompress_time = time.perf_counter() - started
+    assert restored == data
+
+    mb = len(data) / 1e6
+    print(f'{type(codec).__name__:<10} {codec.level!s:>5} '
+          f'{len(data) / len(compressed):>7.2f} '
+          f'{mb / compress_time:>10.1f} {mb / decompress_time:>12.1f}')
+
+
+def main():
+    if len(sys.argv) > 1:
+        data = Path(sys.argv[1]).read_bytes()
+    else:
+        data = ('\n'.join(synthetic_lines(100000)) + '\n').encode()
+    print(f'Data size: {len(data) / 1e6:.1f} MB')
+    print(f'{"codec":<10} {"level":>5} {"ratio":>7} '
+          f'{"comp MB/s":>10} {"decomp MB/s":>12}')
+    for codec in codecs():
+        measure(codec, data)
+
+
+if __name__ == "__main__":
+    main()
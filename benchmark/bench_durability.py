@@ -0,0 +1,75 @@
+"""Compares the append throughput of the durability modes.
+
+    python3 benchmark/bench_durability.py [directory]
+
+The directory should be on the disk of interest: the cost of `fsync`
+depends on it. By default a temporary directory is used.
+"""
+
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# pylint: disable=wrong-import-position
+from linecompress import LinesDir
+from bench_codecs import synthetic_lines  # type: ignore
+
+MODES = [('none', 1.0), ('interval', 1.0), ('interval', 0.1),
+         ('batch', 1.0), ('line', 1.0)]
+
+
+def append_each(ld: LinesDir, lines: List[str]):
+    for line in lines:
+        ld.append(line)
+
+
+def append_many(ld: LinesDir, lines: List[str]):
+    ld.append_many(lines)
+
+
+def group_writer(ld: LinesDir, lines: List[str], threads: int = 8):
+    with ld.group_writer() as writer:
+        def produce(part: List[str]):
+            for line in part:
+                writer.append(line)
+
+        workers = [threading.Thread(target=produce,
+                                    args=(lines[i::threads],))
+                   for i in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+
+def measure(parent: Path, name: str, write: Callable, lines: List[str],
+            mode: str, interval: float):
+    with tempfile.TemporaryDirectory(dir=parent) as tds:
+        ld = LinesDir(Path(tds), buffer_size=4 * 1000 * 1000,
+                      durability=mode, fsync_interval=interval)
+        started = time.perf_counter()
+        write(ld, lines)
+        elapsed = time.perf_counter() - started
+    label = f'{mode} {interval:g}s' if mode == 'interval' else mode
+    print(f'{name:<14} {label:<14} {len(lines) / elapsed:>14,.0f}')
+
+
+def main():
+    parent = Path(sys.argv[1]) if len(sys.argv) > 1 \
+        else Path(tempfile.gettempdir())
+    print(f'{"method":<14} {"durability":<14} {"lines/s":>14}')
+    for name, write, count in [('append', append_each, 2000),
+                               ('append_many', append_many, 200000),
+                               ('group_writer', group_writer, 50000)]:
+        lines = synthetic_lines(count)
+        for mode, interval in MODES:
+            measure(parent, name, write, lines, mode, interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Measures appending, rollover, scanning and tree walking.
+
+    python3 benchmark/bench_suite.py [--quick] [--json results.json]
+    python3 benchmark/bench_suite.py --compare old.json new.json
+
+Each case runs in a separate process, so its peak RSS is its own. The
+results are printed as a table, and saved as JSON with `--json`. Two saved
+runs are compared with `--compare`.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import string
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# pylint: disable=wrong-import-position
+from linecompress import LinesDir, LinesFile, GzipCodec
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+Result = Dict[str, Any]
+
+_WORDS = ['request', 'user', 'session', 'cache', 'timeout', 'retry',
+          'database', 'query', 'ok', 'failed', 'connection', 'id']
+
+
+def generate_lines(count: int, length: int, entropy: str,
+                   seed: int = 0) -> List[str]:
+    """Returns lines of about `length` characters. The 'low' entropy lines
+    are made of a few words and compress well, the 'high' ones are random
+    letters and digits."""
+    rnd = random.Random(seed)
+    result = []
+    for i in range(count):
+        if entropy == 'low':
+            words = [f'{i:08d}']
+            while sum(len(w) + 1 for w in words) < length:
+                words.append(rnd.choice(_WORDS))
+            result.append(' '.join(words))
+        elif entropy == 'high':
+            result.append(''.join(rnd.choices(string.ascii_letters
+                                              + string.digits, k=length)))
+        else:
+            raise ValueError(entropy)
+    return result
+
+
+def populate(root: Path, segments: int, subdirs: int) -> LinesDir:
+    """Creates a directory with that many small compressed files."""
+    ld = LinesDir(root, subdirs=subdirs, buffer_size=100,
+                  codec=GzipCodec(level=1))
+    ld.append_many(generate_lines(segments * 2, 60, 'low'))
+    return ld
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(len(sorted_values) * fraction))]
+
+
+def bench_append(root: Path, segments: int, subdirs: int, count: int,
+                 length: int, entropy: str) -> Result:
+    populate(root, segments, subdirs)
+    ld = LinesDir(root, subdirs=subdirs, buffer_size=64 * 1000)
+    lines = generate_lines(count, length, entropy, seed=1)
+    latencies = []
+    started = time.perf_counter()
+    for line in lines:
+        t = time.perf_counter()
+        ld.append(line)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {'lines_per_sec': count / elapsed,
+            'mb_per_sec': sum(len(s) + 1 for s in lines) / 1e6 / elapsed,
+            'p50_us': _percentile(latencies, 0.5) * 1e6,
+            'p99_us': _percentile(latencies, 0.99) * 1e6}
+
+
+def bench_append_many(root: Path, count: int, length: int,
+                      entropy: str) -> Result:
+    lines = generate_lines(count, length, entropy)
+    ld = LinesDir(root, buffer_size=1000 * 1000)
+    started = time.perf_counter()
+    ld.append_many(lines)
+    elapsed = time.perf_counter() - started
+    return {'lines_per_sec': count / elapsed,
+            'mb_per_sec': sum(len(s) + 1 for s in lines) / 1e6 / elapsed,
+            'files': sum(1 for _ in root.rglob('[0-9]*.txt*'))}
+
+
+def bench_compress(root: Path, size: int, entropy: str) -> Result:
+    file = root / '000.txt'
+    lines = generate_lines(size // 100, 99, entropy)
+    file.write_text(''.join(line + '\n' for line in lines))
+    data_size = file.stat().st_size
+    started = time.perf_counter()
+    LinesFile(file).compress()
+    elapsed = time.perf_counter() - started
+    compressed = root / '000.txt.gz'
+    return {'mb_per_sec': data_size / 1e6 / elapsed,
+            'ratio': data_size / compressed.stat().st_size}
+
+
+def bench_scan(root: Path, count: int, reverse: bool) -> Result:
+    ld = LinesDir(root, buffer_size=1000 * 1000)
+    ld.append_many(generate_lines(count, 100, 'low'))
+    started = time.perf_counter()
+    size = 0
+    lines = 0
+    for line in ld.iter_byte_lines(reverse=reverse):
+        size += len(line) + 1
+        lines += 1
+    elapsed = time.perf_counter() - started
+    assert lines == count
+    return {'lines_per_sec': count / elapsed,
+            'mb_per_sec': size / 1e6 / elapsed}
+
+
+def bench_walk(root: Path, segments: int, subdirs: int) -> Result:
+    ld = populate(root, segments, subdirs)
+    started = time.perf_counter()
+    files = sum(1 for _ in ld._recurse_files(reverse=False))
+    walk_time = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(100):
+        ld._numerically_last_file()
+    last_time = (time.perf_counter() - started) / 100
+    return {'files': files,
+            'files_per_sec': files / walk_time,
+            'last_file_us': last_time * 1e6}
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1e6 if sys.platform == 'darwin' else 1e3)
+
+
+def _run_case(func: Callable, kwargs: Dict[str, Any]) -> Result:
+    with tempfile.TemporaryDirectory() as tds:
+        result = func(Path(tds), **kwargs)
+    result['peak_rss_mb'] = _peak_rss_mb()
+    return result
+
+
+def cases(quick: bool) -> List[Dict[str, Any]]:
+    scale = 10 if quick else 1
+    result: List[Dict[str, Any]] = []
+    for subdirs in [0, 1, 2, 3]:
+        result.append({'name': 'walk', 'func': bench_walk,
+                       'args': {'segments': 2000 // scale,
+                                'subdirs': subdirs}})
+    for length, entropy in [(40, 'low'), (400, 'low'), (400, 'high')]:
+        result.append({'name': 'append', 'func': bench_append,
+                       'args': {'segments': 1000 // scale, 'subdirs': 2,
+                                'count': 5000 // scale, 'length': length,
+                                'entropy': entropy}})
+        result.append({'name': 'append_many', 'func': bench_append_many,
+                       'args': {'count': 200000 // scale, 'length': length,
+                                'entropy': entropy}})
+    for entropy in ['low', 'high']:
+        result.append({'name': 'compress', 'func': bench_compress,
+                       'args': {'size': 4 * 1000 * 1000 // scale,
+                                'entropy': entropy}})
+    for reverse in [False, True]:
+        result.append({'name': 'scan', 'func': bench_scan,
+                       'args': {'count': 300000 // scale,
+                                'reverse': reverse}})
+    return result
+
+
+def _case_id(name: str, args: Dict[str, Any]) -> str:
+    return name + ''.join(f' {k}={v}' for k, v in args.items())
+
+
+def _format(result: Result) -> str:
+    return '  '.join(f'{k}={v:,.1f}' if isinstance(v, float) else f'{k}={v}'
+                     for k, v in result.items())
+
+
+def run(quick: bool) -> Dict[str, Any]:
+    results = {}
+    # a fresh process for each case, so the peak RSS is the case's own
+    context = multiprocessing.get_context('spawn')
+    for case in cases(quick):
+        with context.Pool(1) as pool:
+            result = pool.apply(_run_case, (case['func'], case['args']))
+        case_id = _case_id(case['name'], case['args'])
+        results[case_id] = result
+        print(f'{case_id}\n    {_format(result)}', flush=True)
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'quick': quick,
+            'results': results}
+
+
+def compare(old_file: Path, new_file: Path):
+    """Prints the ratios new/old of the numeric results of each case."""
+    old = json.loads(old_file.read_text())['results']
+    new = json.loads(new_file.read_text())['results']
+    for case_id in sorted(set(old) & set(new)):
+        ratios = []
+        for key, value in new[case_id].items():
+            before = old[case_id].get(key)
+            if isinstance(value, (int, float)) and before:
+                ratios.append(f'{key} {value / before:.2f}x')
+        print(f'{case_id}\n    {"  ".join(ratios)}')
+    for case_id in sorted(set(old) ^ set(new)):
+        print(f'{case_id}\n    only in one of the runs')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='ten times smaller data')
+    parser.add_argument('--json', type=Path, help='save the results')
+    parser.add_argument('--compare', type=Path, nargs=2,
+                        metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = run(args.quick)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,11 @@
-from ._dir import LinesDir
+from ._async import AsyncLinesDir
+from ._catalog import SegmentCatalog
+from ._codecs import Codec, GzipCodec, LzmaCodec, Bz2Codec, ZstdCodec, \
+    Lz4Codec
+from ._cursor import Cursor
+from ._dir import LinesDir, LinesDirWriter
+from ._file import LinesFile
+from ._group_commit import GroupCommitWriter
+from ._metrics import Observer, MetricsCollector
+from ._retention import Retention
+from ._stats import DirStats
@@ -0,0 +1,31 @@
+"""The small append-only files that keep the facts about the compressed
+files, like the numbers of lines. Each fact takes one line, so a file is
+never rewritten."""
+
+from pathlib import Path
+from typing import Callable, List, TypeVar
+
+T = TypeVar('T')
+
+
+def load_entries(file: Path, parse: Callable[[str], T]) -> List[T]:
+    """Returns the parsed lines of the file. The lines for which `parse`
+    raises `ValueError` are skipped. A missing file has no lines."""
+    try:
+        text = file.read_text()
+    except FileNotFoundError:
+        return []
+    result = []
+    for line in text.splitlines():
+        try:
+            result.append(parse(line))
+        except ValueError:
+            # a line left unfinished by an interrupted write
+            continue
+    return result
+
+
+def append_entry(file: Path, line: str):
+    file.parent.mkdir(parents=True, exist_ok=True)
+    with file.open('a') as f:
+        f.write(line + '\n')
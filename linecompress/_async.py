@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+from concurrent.futures import Executor
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, \
+    TypeVar, TYPE_CHECKING
+
+from linecompress._file import encode_line
+
+if TYPE_CHECKING:
+    from linecompress._dir import LinesDir
+
+T = TypeVar('T')
+
+
+def _take(it: Iterator[T], count: int) -> List[T]:
+    return list(itertools.islice(it, count))
+
+
+class AsyncLinesDir:
+    """The asyncio interface to a `LinesDir`.
+
+    The file operations and the compression run in the `executor` (the
+    default executor of the loop, if not set), so they do not block the
+    event loop.
+
+    The lines appended by concurrent coroutines are collected while the
+    previous batch is being written, and are written together with a single
+    `append_many` call. So only one write is in progress at a time.
+
+    The lines are read in chunks of `chunk_lines`. The next chunk is read
+    only when the previous one is consumed.
+    """
+
+    def __init__(self, lines_dir: LinesDir,
+                 executor: Optional[Executor] = None,
+                 chunk_lines: int = 1000):
+        if chunk_lines < 1:
+            raise ValueError(chunk_lines)
+        self.lines_dir = lines_dir
+        self._executor = executor
+        self._chunk_lines = chunk_lines
+        self._pending: List[str] = []
+        self._pending_written: Optional[asyncio.Future] = None
+        self._writing: Optional[asyncio.Task] = None
+
+    async def _write_pending(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            batch, self._pending = self._pending, []
+            written, self._pending_written = self._pending_written, None
+            assert written is not None
+            try:
+                await loop.run_in_executor(self._executor,
+                                           self.lines_dir.append_many, batch)
+            except BaseException as e:  # pylint: disable=broad-except
+                written.set_exception(e)
+            else:
+                written.set_result(None)
+        self._writing = None
+
+    async def append_many(self, lines: Iterable[str]):
+        """Appends the lines and returns when they are written."""
+        lines = list(lines)
+        for text in lines:
+            encode_line(text)  # raising the errors here, not in the batch
+        if not lines:
+            return
+        loop = asyncio.get_running_loop()
+        self._pending.extend(lines)
+        if self._pending_written is None:
+            self._pending_written = loop.create_future()
+        written = self._pending_written
+        if self._writing is None:
+            self._writing = loop.create_task(self._write_pending())
+        # the batch is written even if the caller is cancelled
+        await asyncio.shield(written)
+
+    async def append(self, text: str):
+        await self.append_many([text])
+
+    async def _lines(self, lines: Iterable[T]) -> AsyncIterator[T]:
+        loop = asyncio.get_running_loop()
+        it = iter(lines)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(
+                    self._executor, _take, it, self._chunk_lines)
+                if not chunk:
+                    return
+                for line in chunk:
+                    yield line
+        finally:
+            close = getattr(it, 'close', None)
+            if close is not None:
+                close()
+
+    def iter_str_lines(self, reverse: bool = False, start: int = 0) \
+            -> AsyncIterator[str]:
+        return self._lines(self.lines_dir.iter_str_lines(reverse=reverse,
+                                                         start=start))
+
+    def iter_byte_lines(self, reverse: bool = False, start: int = 0) \
+            -> AsyncIterator[bytes]:
+        return self._lines(self.lines_dir.iter_byte_lines(reverse=reverse,
+                                                          start=start))
+
+    def reversed(self) -> AsyncIterator[str]:
+        return self.iter_str_lines(reverse=True)
+
+    async def wait_compressed(self):
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.lines_dir.wait_compressed)
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self.iter_str_lines()
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from typing import Callable, List, Optional, Set
+
+
+class BackgroundCompressor:
+    """Compresses files in a background thread by calling `compress` for
+    each submitted file.
+
+    The compression itself follows the usual `LinesFile.compress` protocol:
+    the data is written to a dirty temporary file that is renamed only when
+    complete. So an interrupted compression leaves the raw file intact.
+
+    No more than `max_pending` files can be queued or in progress.
+    Submitting one more file blocks until a slot is free.
+    """
+
+    def __init__(self, compress: Callable[[Path], object],
+                 max_pending: int = 4):
+        if max_pending < 1:
+            raise ValueError(max_pending)
+        self._compress_file = compress
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_progress: Set[Path] = set()
+        self._futures: List[Future] = []
+
+    def _compress(self, file: Path):
+        try:
+            self._compress_file(file)
+        finally:
+            with self._lock:
+                self._in_progress.discard(file)
+            self._slots.release()
+
+    def submit(self, file: Path):
+        with self._lock:
+            if file in self._in_progress:
+                return
+            self._in_progress.add(file)
+        self._slots.acquire()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix='linecompress')
+            # keeping only the futures that may raise in `wait`
+            self._futures = [f for f in self._futures
+                             if not f.done() or f.exception() is not None]
+            self._futures.append(self._executor.submit(self._compress, file))
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._in_progress)
+
+    def wait(self):
+        """Blocks until all the submitted files are compressed. Reraises the
+        first error that occurred during the compression."""
+        with self._lock:
+            futures = self._futures
+            self._futures = []
+        error: Optional[BaseException] = None
+        for f in futures:
+            e = f.exception()
+            if error is None:
+                error = e
+        if error is not None:
+            raise error
@@ -0,0 +1,217 @@
+"""Listing the numbered files of a directory tree.
+
+The walk reads each directory with `os.scandir` and keeps the numbers as
+plain integers: the number of a file is the number of its directory times
+1000 plus its own. No `Path` objects are created until a path is requested.
+
+A `SegmentCatalog` keeps a whole listing in two arrays: the numbers and the
+kinds of the names (like '.txt' or '.txt.gz' after the number). So even a
+million files take a few megabytes.
+"""
+
+from __future__ import annotations
+
+import bisect
+import os
+import re
+import time
+from array import array
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from linecompress._file import _codec_suffix, _is_dirty_name, \
+    _is_sidecar_name
+
+_NUM_PREFIX_RE = re.compile(r'^\d+')
+
+
+def _numbered_names(directory: str, reverse: bool) -> List[Tuple[int, str]]:
+    try:
+        with os.scandir(directory) as entries:
+            names = [e.name for e in entries]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+    result = []
+    for name in names:
+        m = _NUM_PREFIX_RE.match(name)
+        if m is not None:
+            result.append((int(m.group(0)), name))
+    result.sort(reverse=reverse)
+    return result
+
+
+class Segment:
+    """A numbered file found by the walk."""
+    __slots__ = ('num', 'directory', 'name')
+
+    def __init__(self, num: int, directory: str, name: str):
+        self.num = num
+        self.directory = directory
+        self.name = name
+
+    @property
+    def path(self) -> Path:
+        return Path(self.directory, self.name)
+
+
+def _chosen(group: List[Tuple[int, str]]) -> str:
+    """Returns the name to list among the names with the same number: the
+    compressed file goes first, since a raw one is either a leftover or
+    being removed."""
+    for _, name in group:
+        if _codec_suffix(name) is not None:
+            return name
+    return group[0][1]
+
+
+def iter_segments(root: Path, subdirs: int, reverse: bool = False,
+                  start: Optional[int] = None,
+                  on_listing: Optional[Callable[[float], None]] = None) \
+        -> Iterator[Segment]:
+    """Yields one file for each number, in the order of the numbers.
+
+    With `start` (only for the forward walk) the files with smaller numbers
+    are skipped, and the directories with only such files are not read.
+    `on_listing` is called with the duration of each directory listing."""
+    if start is not None and reverse:
+        raise ValueError("Cannot start reversed walk")
+
+    def walk(directory: str, prefix: int, levels: int,
+             start: Optional[int]) -> Iterator[Segment]:
+        started = time.perf_counter() if on_listing is not None else 0.0
+        names = _numbered_names(directory, reverse)
+        if on_listing is not None:
+            on_listing(time.perf_counter() - started)
+        if levels > 0:
+            for n, name in names:
+                num = prefix * 1000 + n
+                sub_start = None
+                if start is not None:
+                    bound = start // 1000 ** levels
+                    if num < bound:
+                        continue
+                    if num == bound:
+                        sub_start = start
+                yield from walk(os.path.join(directory, name), num,
+                                levels - 1, sub_start)
+            return
+        group: List[Tuple[int, str]] = []
+        for n, name in names:
+            if _is_dirty_name(name) or _is_sidecar_name(name):
+                continue
+            if group and group[0][0] != n:
+                yield Segment(prefix * 1000 + group[0][0], directory,
+                              _chosen(group))
+                group = []
+            if start is None or prefix * 1000 + n >= start:
+                group.append((n, name))
+        if group:
+            yield Segment(prefix * 1000 + group[0][0], directory,
+                          _chosen(group))
+
+    yield from walk(str(root), 0, subdirs, start)
+
+
+class SegmentCatalog:
+    """The numbered files of a directory, in the order of the numbers.
+
+    Each file takes nine bytes: the number, and the index of the rest of
+    its name in a small table. The paths are built only when requested.
+    The files with the names not in the usual `000/000/000.txt` form are
+    kept in a separate dictionary.
+    """
+
+    def __init__(self, root: Path, subdirs: int):
+        self.root = root
+        self.subdirs = subdirs
+        self.nums = array('q')
+        self._kinds = array('B')
+        self._suffixes: List[str] = []
+        self._suffix_kinds: Dict[str, int] = {}
+        # the relative paths of the files with unusual names
+        self._unusual: Dict[int, str] = {}
+        self._root_str = str(root)
+        self._usual_dir: Optional[Tuple[str, bool]] = None
+
+    @staticmethod
+    def scan(root: Path, subdirs: int,
+             on_listing: Optional[Callable[[float], None]] = None) \
+            -> SegmentCatalog:
+        catalog = SegmentCatalog(root, subdirs)
+        for segment in iter_segments(root, subdirs, on_listing=on_listing):
+            catalog.add(segment)
+        return catalog
+
+    def _relative_dir(self, num: int) -> str:
+        parts = []
+        for _ in range(self.subdirs):
+            num, n = divmod(num, 1000)
+            parts.append(f'{n:03d}')
+        return os.path.join(*reversed(parts)) if parts else ''
+
+    def _is_usual_dir(self, directory: str, num: int) -> bool:
+        # the files of a directory come together, so it is checked once
+        if self._usual_dir is None or self._usual_dir[0] != directory:
+            expected = os.path.join(self._root_str,
+                                    self._relative_dir(num // 1000))
+            self._usual_dir = (directory,
+                               num < 1000 ** (self.subdirs + 1)
+                               and os.path.normpath(directory)
+                               == os.path.normpath(expected))
+        return self._usual_dir[1]
+
+    def add(self, segment: Segment):
+        """Adds the file with a number larger than all the previous."""
+        num = segment.num
+        if self.nums and num <= self.nums[-1]:
+            raise ValueError(num)
+        name = segment.name
+        suffix = name[3:]
+        if self._is_usual_dir(segment.directory, num) \
+                and name[:3] == f'{num % 1000:03d}' \
+                and not suffix[:1].isdigit():
+            kind = self._suffix_kinds.get(suffix)
+            if kind is None and len(self._suffixes) < 255:
+                kind = self._suffix_kinds[suffix] = len(self._suffixes)
+                self._suffixes.append(suffix)
+        else:
+            kind = None
+        if kind is None:
+            kind = 255
+            self._unusual[num] = os.path.relpath(
+                os.path.join(segment.directory, name), self._root_str)
+        self.nums.append(num)
+        self._kinds.append(kind)
+
+    def __len__(self) -> int:
+        return len(self.nums)
+
+    def __contains__(self, num: int) -> bool:
+        i = bisect.bisect_left(self.nums, num)
+        return i < len(self.nums) and self.nums[i] == num
+
+    def index(self, num: int) -> int:
+        """Returns the position of the first file with the number not less
+        than `num`."""
+        return bisect.bisect_left(self.nums, num)
+
+    def path(self, i: int) -> Path:
+        num = self.nums[i]
+        kind = self._kinds[i]
+        if kind == 255:
+            return self.root / self._unusual[num]
+        return self.root / self._relative_dir(num // 1000) \
+            / f'{num % 1000:03d}{self._suffixes[kind]}'
+
+    def paths(self, start: Optional[int] = None,
+              reverse: bool = False) -> Iterator[Path]:
+        """Yields the paths from the file with the number `start` towards
+        the last file, or towards the first if `reverse`. If there is no
+        file with that number, starts from the next one in that direction.
+        Without `start` all the files are yielded."""
+        if reverse:
+            last = len(self.nums) - 1 if start is None \
+                else bisect.bisect_right(self.nums, start) - 1
+            return (self.path(i) for i in range(last, -1, -1))
+        return (self.path(i) for i in range(
+            0 if start is None else self.index(start), len(self.nums)))
@@ -0,0 +1,155 @@
+"""Compression formats of the files.
+
+The format of a compressed file is defined by its suffix: `000.txt.gz`,
+`000.txt.xz` and so on. So a directory may contain files in different
+formats, and the readers do not need to be told which one to use.
+
+All the formats allow concatenating independently compressed parts into a
+single file: the result is decompressed as the concatenation of the parts.
+"""
+
+from __future__ import annotations
+
+import abc
+import bz2
+import gzip
+import io
+import lzma
+from typing import BinaryIO, Callable, Dict, Optional
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame  # type: ignore
+except ImportError:
+    lz4 = None
+
+
+class Codec(abc.ABC):
+    """Base class for the compression formats.
+
+    `level` is the compression level in the terms of the underlying
+    library, or None for the default level."""
+
+    suffix = ''
+
+    def __init__(self, level: Optional[int] = None):
+        self.level = level
+
+    @abc.abstractmethod
+    def writer(self, fileobj: BinaryIO) -> BinaryIO:
+        """Returns a stream that compresses the data to `fileobj`. Closing
+        the stream does not close `fileobj`."""
+
+    @abc.abstractmethod
+    def reader(self, fileobj: BinaryIO) -> BinaryIO:
+        """Returns a stream that decompresses the data from the current
+        position of `fileobj` to the end."""
+
+    def compress(self, data: bytes) -> bytes:
+        buffer = io.BytesIO()
+        with self.writer(buffer) as out:
+            out.write(data)
+        return buffer.getvalue()
+
+    def __repr__(self):
+        return f'{type(self).__name__}(level={self.level!r})'
+
+
+class GzipCodec(Codec):
+    suffix = '.gz'
+    level: int
+
+    def __init__(self, level: Optional[int] = None):
+        super().__init__(9 if level is None else level)
+
+    def writer(self, fileobj: BinaryIO) -> BinaryIO:
+        return gzip.GzipFile(fileobj=fileobj, mode='wb',  # type: ignore
+                             compresslevel=self.level)
+
+    def reader(self, fileobj: BinaryIO) -> BinaryIO:
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')  # type: ignore
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.level)
+
+
+class LzmaCodec(Codec):
+    suffix = '.xz'
+
+    def writer(self, fileobj: BinaryIO) -> BinaryIO:
+        return lzma.LZMAFile(fileobj, mode='wb',  # type: ignore
+                             preset=self.level)
+
+    def reader(self, fileobj: BinaryIO) -> BinaryIO:
+        return lzma.LZMAFile(fileobj, mode='rb')  # type: ignore
+
+
+class Bz2Codec(Codec):
+    suffix = '.bz2'
+    level: int
+
+    def __init__(self, level: Optional[int] = None):
+        super().__init__(9 if level is None else level)
+
+    def writer(self, fileobj: BinaryIO) -> BinaryIO:
+        return bz2.BZ2File(fileobj, mode='wb',  # type: ignore
+                           compresslevel=self.level)
+
+    def reader(self, fileobj: BinaryIO) -> BinaryIO:
+        return bz2.BZ2File(fileobj, mode='rb')  # type: ignore
+
+
+class ZstdCodec(Codec):
+    """Requires the `zstandard` package."""
+    suffix = '.zst'
+
+    def __init__(self, level: Optional[int] = None):
+        if zstandard is None:
+            raise ImportError("ZstdCodec requires the 'zstandard' package")
+        super().__init__(3 if level is None else level)
+
+    def writer(self, fileobj: BinaryIO) -> BinaryIO:
+        return zstandard.ZstdCompressor(level=self.level) \
+            .stream_writer(fileobj, closefd=False)
+
+    def reader(self, fileobj: BinaryIO) -> BinaryIO:
+        return zstandard.ZstdDecompressor() \
+            .stream_reader(fileobj, read_across_frames=True, closefd=False)
+
+
+class Lz4Codec(Codec):
+    """Requires the `lz4` package."""
+    suffix = '.lz4'
+
+    def __init__(self, level: Optional[int] = None):
+        if lz4 is None:
+            raise ImportError("Lz4Codec requires the 'lz4' package")
+        super().__init__(0 if level is None else level)
+
+    def writer(self, fileobj: BinaryIO) -> BinaryIO:
+        return lz4.frame.LZ4FrameFile(fileobj, mode='wb',
+                                      compression_level=self.level)
+
+    def reader(self, fileobj: BinaryIO) -> BinaryIO:
+        return lz4.frame.LZ4FrameFile(fileobj, mode='rb')
+
+
+_CODECS: Dict[str, Callable[[], Codec]] = {
+    GzipCodec.suffix: GzipCodec,
+    LzmaCodec.suffix: LzmaCodec,
+    Bz2Codec.suffix: Bz2Codec,
+    ZstdCodec.suffix: ZstdCodec,
+    Lz4Codec.suffix: Lz4Codec,
+}
+
+CODEC_SUFFIXES = list(_CODECS)
+
+
+def codec_for_suffix(suffix: str) -> Codec:
+    """Returns the codec with the default level for reading the files with
+    the suffix."""
+    return _CODECS[suffix]()
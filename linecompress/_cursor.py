@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from typing import NamedTuple
+
+
+class Cursor(NamedTuple):
+    """The position right after a line: the number of the file and the
+    byte offset in its text data.
+
+    The offset is the same whether the file is raw or compressed, so the
+    cursor stays valid after the compression. As a string it looks like
+    `12:3456`.
+    """
+    num: int
+    offset: int
+
+    def __str__(self) -> str:
+        return f'{self.num}:{self.offset}'
+
+    @staticmethod
+    def parse(text: str) -> Cursor:
+        try:
+            num, offset = (int(part) for part in text.split(':'))
+        except ValueError:
+            raise ValueError(f"Not a cursor: {text!r}") from None
+        if num < 0 or offset < 0:
+            raise ValueError(f"Not a cursor: {text!r}")
+        return Cursor(num, offset)
@@ -1,10 +1,38 @@
 from __future__ import annotations
 
+import functools
+import itertools
+import os
+import select
+import time
 from pathlib import Path
-from typing import List, Optional, Iterable, Union
+from typing import List, Optional, Iterable, Union, BinaryIO, Tuple, \
+    Callable, TypeVar, Any
 
-from linecompress._file import is_compressed_path, is_rawdata_path, LinesFile
-from linecompress._search_last import _recurse_paths, _num_prefix_str
+from linecompress._background import BackgroundCompressor
+from linecompress._catalog import Segment, SegmentCatalog, iter_segments
+from linecompress._file import is_compressed_path, is_rawdata_path, \
+    LinesFile, encode_line, \
+    CompressedElsewhere, _without_last_newline, \
+    to_compressed_path, compressed_paths, to_sketch_path, _codec_suffix, \
+    to_rawdata_path, to_index_path, _remove_if_exists
+from linecompress._codecs import Codec, GzipCodec
+from linecompress._cursor import Cursor
+from linecompress._durability import SyncPolicy, fsync_dir
+from linecompress._grep import PatternArg
+from linecompress._group_commit import GroupCommitWriter
+from linecompress._key_bounds import KeyBounds, Bounds, bounds_of, \
+    merged_bounds
+from linecompress._line_counts import LineCounts
+from linecompress._locks import DirLock
+from linecompress._manifest import Manifest
+from linecompress._metrics import Observer, timed
+from linecompress._retention import Retention, OldestSizes
+from linecompress._stats import DirStats
+from linecompress._parallel import parallel_map
+from linecompress._sketch import tokens_of
+from linecompress._watch import ChangeWaiter
+from linecompress._search_last import _num_prefix_str, _num_prefix
 
 
 def _split_nums(x: int, length: Optional[int] = None) -> List[int]:
@@ -29,6 +57,62 @@ def _combine_nums(nums: List[int]) -> int:
                for power, num in enumerate(reversed(nums)))
 
 
+T = TypeVar('T')
+
+_WRITE_CHUNK_SIZE = 1 << 16
+
+_LINE_COUNTS_NAME = 'line_counts.txt'
+_MANIFEST_NAME = 'manifest.json'
+_KEY_BOUNDS_NAME = 'key_bounds.txt'
+_TEXT_SIZES_NAME = 'text_sizes.txt'
+_LOCK_NAME = 'lock'
+
+# the writes of this size to a file opened for appending are not mixed
+# with the concurrent writes of other processes
+_ATOMIC_APPEND_SIZE = getattr(select, 'PIPE_BUF', 512)
+
+
+def _write_appending(file: Path, data: bytes, fsync: bool = False):
+    fd = os.open(file, os.O_WRONLY | os.O_APPEND | os.O_CREAT
+                 | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+        if fsync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _end_of_whole_lines(lf: LinesFile, chunk_size: int = 1 << 16) -> int:
+    """Returns the offset after the last newline of the file."""
+    pos = lf.size
+    while pos > 0:
+        chunk_start = max(0, pos - chunk_size)
+        newline = lf.read_bytes(chunk_start, pos - chunk_start).rfind(b'\n')
+        if newline >= 0:
+            return chunk_start + newline + 1
+        pos = chunk_start
+    return 0
+
+
+def _batches(lines: Iterable[str], size: int) -> Iterable[bytes]:
+    """Joins the encoded lines into batches no larger than `size`, unless
+    a single line is larger."""
+    batch: List[bytes] = []
+    batch_size = 0
+    for text in lines:
+        data = encode_line(text)
+        if batch and batch_size + len(data) > size:
+            yield b''.join(batch)
+            batch = []
+            batch_size = 0
+        batch.append(data)
+        batch_size += len(data)
+    if batch:
+        yield b''.join(batch)
+
+
 class NumberedFilePath:
     def __init__(self, root: Path, nums: List[int], suffix: str):
         self.root = root
@@ -86,36 +170,446 @@ class LinesDir(Iterable[str]):
     def __init__(self,
                  path: Path,
                  subdirs: int = 2,
-                 buffer_size: int = 1000 * 1000):
+                 buffer_size: int = 1000 * 1000,
+                 background_compression: bool = False,
+                 max_pending_compressions: int = 4,
+                 index_span: Optional[int] = None,
+                 manifest: bool = False,
+                 codec: Optional[Codec] = None,
+                 sketches: bool = False,
+                 key: Optional[Callable[[str], Any]] = None,
+                 multiprocess: bool = False,
+                 durability: str = 'none',
+                 fsync_interval: float = 1.0,
+                 retention: Optional[Retention] = None,
+                 observer: Optional[Observer] = None):
         self._path = path
         self._subdirs = subdirs
         self.max_file_size = buffer_size
+        self.index_span = index_span
+        self.codec = codec if codec is not None else GzipCodec()
+        self.sketches = sketches
+        self.key = key
+        self._sync = SyncPolicy(durability, interval=fsync_interval)
+        self.retention = retention
+        self.observer = observer
+        self._oldest_sizes = OldestSizes()
+        self._key_bounds = KeyBounds(path / _KEY_BOUNDS_NAME)
+        self._dir_lock: Optional[DirLock] = \
+            DirLock(path / _LOCK_NAME) if multiprocess else None
+        self._line_counts = LineCounts(path / _LINE_COUNTS_NAME)
+        self._text_sizes = LineCounts(path / _TEXT_SIZES_NAME)
+        self._manifest: Optional[Manifest] = \
+            Manifest(path / _MANIFEST_NAME) if manifest else None
+        self._files_range: Optional[Tuple[int, int]] = None
         # self._suffix = suffix
+        self._compressor: Optional[BackgroundCompressor] = \
+            BackgroundCompressor(self._compress_now,
+                                 max_pending=max_pending_compressions) \
+            if background_compression else None
 
     @property
     def path(self):
         return self._path
 
-    def _recurse_files(self, reverse: bool) -> Iterable[Path]:
-        return _recurse_paths(parent=self._path,
-                              go_deeper=self._subdirs,
-                              reverse=reverse)
+    def _recurse_files(self, reverse: bool, start: Optional[int] = None) \
+            -> Iterable[Path]:
+        """Returns one file for each number. The dirty files and the
+        sidecar files are ignored.
+        If both compressed and raw files exist for a number, the compressed
+        one is returned: the raw file is either a leftover, or it is
+        removed right now.
+
+        With `start` the files with smaller numbers are skipped."""
+        if self._manifest is not None:
+            return self._listed_files(reverse=reverse, start=start)
+        return self._walk_files(reverse=reverse, start=start)
+
+    def _listed_files(self, reverse: bool, start: Optional[int] = None) \
+            -> Iterable[Path]:
+        """Same as `_walk_files`, but the numbers are taken from the
+        manifest, and the directories are not read."""
+        files_range = self._actual_files_range()
+        if files_range is None:
+            return
+        first, last = files_range
+        if start is not None:
+            first = max(first, start)
+        nums = range(last, first - 1, -1) if reverse \
+            else range(first, last + 1)
+        for num in nums:
+            file = self._existing_file(num)
+            if file is not None:
+                yield file
+
+    def _walk_files(self, reverse: bool, start: Optional[int] = None) \
+            -> Iterable[Path]:
+        return (segment.path for segment
+                in self._walk_segments(reverse=reverse, start=start))
+
+    def _walk_segments(self, reverse: bool, start: Optional[int] = None) \
+            -> Iterable[Segment]:
+        on_listing: Optional[Callable[[float], None]] = None
+        if self.observer is not None:
+            self.observer.count('walk')
+            on_listing = functools.partial(self.observer.timing,
+                                           'dir_listing')
+        return iter_segments(self._path, self._subdirs, reverse=reverse,
+                             start=start, on_listing=on_listing)
+
+    def catalog(self) -> SegmentCatalog:
+        """Lists the files of the directory in a compact form: the numbers
+        and the names of the files, in the order of the numbers."""
+        catalog = SegmentCatalog(self._path, self._subdirs)
+        if self._manifest is not None:
+            for file in self._listed_files(reverse=False):
+                catalog.add(Segment(self._file_num(file), str(file.parent),
+                                    file.name))
+        else:
+            for segment in self._walk_segments(reverse=False):
+                catalog.add(segment)
+        return catalog
 
     def _numerically_last_file(self) -> Optional[Path]:
         for first in self._recurse_files(reverse=True):
             return first
         return None
 
+    def _raw_path(self, num: int) -> Path:
+        return NumberedFilePath(
+            self._path, _split_nums(num, length=self._subdirs + 1),
+            '.txt').path
+
+    def _existing_file(self, num: int) -> Optional[Path]:
+        """Returns the compressed or the raw file with the number, if any
+        of them exists."""
+        raw = self._raw_path(num)
+        compressed = to_compressed_path(raw, self.codec.suffix)
+        # the raw file is removed after the compressed one is created
+        for file in [compressed, raw, compressed]:
+            if file.exists():
+                return file
+        # the file may have been written with another codec
+        for file in compressed_paths(raw):
+            if file.exists():
+                return file
+        return None
+
+    def _is_actual(self, files_range: Tuple[int, int]) -> bool:
+        first, last = files_range
+        after_last = self._raw_path(last + 1)
+        return self._existing_file(first) is not None \
+               and self._existing_file(last) is not None \
+               and not after_last.exists() \
+               and not to_compressed_path(after_last,
+                                          self.codec.suffix).exists()
+
+    def _actual_files_range(self) -> Optional[Tuple[int, int]]:
+        """Returns the numbers of the first and the last files. They are
+        read from the manifest, or the manifest is rebuilt from the tree if
+        it is missing or stale."""
+        assert self._manifest is not None
+        for files_range in [self._files_range, self._manifest.load()]:
+            if files_range is not None and self._is_actual(files_range):
+                self._files_range = files_range
+                return files_range
+        first = next(iter(self._walk_files(reverse=False)), None)
+        last = next(iter(self._walk_files(reverse=True)), None)
+        if first is None or last is None:
+            self._files_range = None
+            return None
+        self._files_range = (self._file_num(first), self._file_num(last))
+        self._manifest.save(*self._files_range)
+        return self._files_range
+
+    def _sync_created(self, file: Path):
+        """Makes the entry of the new file durable, along with the entries
+        of the directories that may have been created for it."""
+        if not self._sync.syncs:
+            return
+        for parent in file.relative_to(self._path).parents:
+            fsync_dir(self._path / parent)
+
+    def _file_created(self, file: Path):
+        """Adds the new last file to the manifest."""
+        if self._manifest is None:
+            return
+        num = self._file_num(file)
+        if self._files_range is None:
+            self._files_range = (num, num)
+        elif num > self._files_range[1]:
+            self._files_range = (self._files_range[0], num)
+        else:
+            return
+        self._manifest.save(*self._files_range)
+
     def _compressed_before_or_just_now(self, file: Path) -> bool:
         if is_compressed_path(file):
             return True
         if file.stat().st_size >= self.max_file_size:
             assert file.exists()
-            LinesFile(file).compress()
+            with timed(self.observer, 'rollover'):
+                self._compress(file)
+            return True
+        return False
+
+    def _compress(self, file: Path):
+        if self._compressor is not None:
+            self._compressor.submit(file)
+        elif self._compress_now(file):
             assert not file.exists()  # raw text removed
+
+    def _compress_now(self, file: Path) -> bool:
+        """Returns False if the file is compressed by someone else."""
+        lf = LinesFile(file)
+        if lf.is_compressed:
+            return False
+        key = self.key
+        # the facts about the lines are gathered while compressing them
+        text_size = 0
+        block_bounds: List[Bounds] = []
+
+        def inspect(block: bytes):
+            nonlocal text_size
+            text_size += len(block)
+            if key is not None:
+                text = _without_last_newline(block).decode('utf-8')
+                block_bounds.append(bounds_of(text.split('\n'), key))
+
+        try:
+            with timed(self.observer, 'compress'):
+                lines = lf.compress(index_span=self.index_span,
+                                    codec=self.codec, sketch=self.sketches,
+                                    fsync=self._sync.syncs, inspect=inspect)
+        except CompressedElsewhere:
+            return False
+        if self.observer is not None:
+            self.observer.count('bytes_out', lf.size)
+        num = self._file_num(file)
+        if key is not None:
+            self._key_bounds.add(num, merged_bounds(block_bounds))
+        self._line_counts.add(num, lines)
+        self._text_sizes.add(num, text_size)
+        if self.retention is not None:
+            self.prune()
+        return True
+
+    def _reading(self, file: Path) -> LinesFile:
+        """Returns the file for reading the lines."""
+        if self.observer is not None:
+            self.observer.count('segment_open')
+        return LinesFile(file, cleanup=self._compressor is None)
+
+    def _file_num(self, file: Path) -> int:
+        num = 0
+        for part in file.parts[-(self._subdirs + 1):]:
+            n = _num_prefix(part)
+            if n is None:
+                raise ValueError(file)
+            num = num * 1000 + n
+        return num
+
+    def _count_lines(self, file: Path) -> int:
+        """Returns the number of lines in the file. For compressed files
+        the counts are saved, so each file is counted only once."""
+        if not is_compressed_path(file):
+            return LinesFile(file, cleanup=False).count_lines()
+        num = self._file_num(file)
+        count = self._line_counts.get(num)
+        if count is None:
+            count = LinesFile(file, cleanup=False).count_lines()
+            self._line_counts.add(num, count)
+        return count
+
+    def _text_counts(self, file: Path) -> Tuple[int, int]:
+        """Returns the number of lines and the text size of the compressed
+        file. They are saved, so each file is read at most once."""
+        num = self._file_num(file)
+        lines = self._line_counts.get(num)
+        size = self._text_sizes.get(num)
+        if lines is None or size is None:
+            lines, size = LinesFile(file, cleanup=False).count_text()
+            self._line_counts.add(num, lines)
+            self._text_sizes.add(num, size)
+        return lines, size
+
+    def stats(self) -> DirStats:
+        """Returns the numbers of the files, the lines and the bytes in the
+        directory.
+
+        The numbers of lines and the text sizes of the compressed files are
+        saved when they are compressed, so only the raw files are read.
+        The files compressed by older versions are read once, and then
+        their numbers are saved too."""
+        files = compressed_files = lines = disk_bytes = text_bytes = 0
+        for file in self._recurse_files(reverse=False):
+            try:
+                size = file.stat().st_size
+            except FileNotFoundError:
+                # compressed since listed, or removed
+                found = self._existing_file(self._file_num(file))
+                if found is None:
+                    continue
+                file = found
+                size = file.stat().st_size
+            files += 1
+            disk_bytes += size
+            if is_compressed_path(file):
+                compressed_files += 1
+                file_lines, file_size = self._text_counts(file)
+                lines += file_lines
+                text_bytes += file_size
+            else:
+                lines += LinesFile(file, cleanup=False).count_lines()
+                text_bytes += size
+        return DirStats(files=files, compressed_files=compressed_files,
+                        lines=lines, disk_bytes=disk_bytes,
+                        text_bytes=text_bytes)
+
+    def _file_key_bounds(self, file: Path) -> Bounds:
+        """Returns the bounds of the keys in the file. For compressed files
+        the bounds are saved, so each file is read only once."""
+        assert self.key is not None
+        lf = LinesFile(file, cleanup=False)
+        if not lf.is_compressed:
+            return bounds_of(lf.iter_str_lines(), self.key)
+        num = self._file_num(file)
+        known, bounds = self._key_bounds.get(num)
+        if not known:
+            bounds = bounds_of(lf.iter_str_lines(), self.key)
+            self._key_bounds.add(num, bounds)
+        return bounds
+
+    def _may_have_keys(self, file: Path, low: Any, high: Any) -> bool:
+        bounds = self._file_key_bounds(file)
+        return bounds is not None and bounds[1] >= low and bounds[0] < high
+
+    def _files_in_range(self, low: Any, high: Any) -> Iterable[Path]:
+        """Yields the files that may contain the keys in `[low, high)`."""
+        first = next(iter(self._recurse_files(reverse=False)), None)
+        if first is None:
+            return
+        start, skip_from, skip_to = self._key_bounds.skippable(
+            self._file_num(first), low, high)
+        for file in self._recurse_files(reverse=False, start=start):
+            if skip_from <= self._file_num(file) < skip_to:
+                # all the files up to `skip_to` have the keys after the range
+                for after in self._recurse_files(reverse=False,
+                                                 start=skip_to):
+                    if self._may_have_keys(after, low, high):
+                        yield after
+                return
+            if self._may_have_keys(file, low, high):
+                yield file
+
+    def _files_from_line(self, line: int) -> Tuple[Iterable[Path], int]:
+        """Returns the files starting from the one that contains the line,
+        and the number of the line within that file."""
+        first = next(iter(self._recurse_files(reverse=False)), None)
+        if first is None:
+            return [], 0
+        num, line = self._line_counts.find(self._file_num(first), line)
+        files = iter(self._recurse_files(reverse=False, start=num))
+        for file in files:
+            count = self._count_lines(file)
+            if line < count:
+                return itertools.chain([file], files), line
+            line -= count
+        return [], 0
+
+    def _remove_file(self, file: Path):
+        """Removes the compressed file with its sidecars, and the
+        directories left empty."""
+        raw = to_rawdata_path(file)
+        suffix = _codec_suffix(file.name)
+        assert suffix is not None
+        # a leftover raw file would take the place of the compressed one
+        _remove_if_exists(raw)
+        _remove_if_exists(file)
+        for sidecar in [to_index_path(raw, suffix),
+                        to_sketch_path(raw, suffix)]:
+            _remove_if_exists(sidecar)
+        parent = file.parent
+        while parent != self._path:
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break  # not empty
+            parent = parent.parent
+
+    def _must_remove(self, file: Path, retention: Retention,
+                     files: int, total: int) -> bool:
+        if retention.max_files is not None and files > retention.max_files:
+            return True
+        if retention.max_bytes is not None and total > retention.max_bytes:
             return True
+        if retention.max_age is not None \
+                and file.stat().st_mtime < time.time() - retention.max_age:
+            return True
+        if retention.min_key is not None:
+            bounds = self._file_key_bounds(file)
+            return bounds is not None and bounds[1] < retention.min_key
         return False
 
+    def prune(self, retention: Optional[Retention] = None) -> int:
+        """Removes the oldest compressed files exceeding the limits of the
+        `retention` (by default, the one of the directory). Returns the
+        number of the removed files.
+
+        The sizes of the compressed files are remembered, so each call
+        lists only the files that appeared since the previous one. The
+        directories left empty are removed.
+
+        The readers that have already opened a removed file read it to the
+        end. The others skip it."""
+        if retention is None:
+            retention = self.retention
+        if retention is None:
+            raise ValueError("No retention limits")
+        if retention.min_key is not None and self.key is None:
+            raise ValueError("The key is required for min_key")
+        sizes = self._oldest_sizes
+        with sizes.lock:
+            newer_files = 0
+            newer_bytes = 0
+            for file in self._recurse_files(reverse=False,
+                                            start=sizes.next_num):
+                try:
+                    size = file.stat().st_size
+                except FileNotFoundError:
+                    continue  # just compressed or removed
+                if newer_files == 0 and is_compressed_path(file):
+                    sizes.add(self._file_num(file), size)
+                else:
+                    newer_files += 1
+                    newer_bytes += size
+            removed = 0
+            while len(sizes) + newer_files > 1:
+                oldest_num = sizes.oldest_num()
+                if oldest_num is None:
+                    break  # only the raw files remain
+                existing = self._existing_file(oldest_num)
+                if existing is not None and not is_compressed_path(existing):
+                    break  # only a leftover raw file remains
+                if existing is not None:
+                    if not self._must_remove(existing, retention,
+                                             files=len(sizes) + newer_files,
+                                             total=sizes.total + newer_bytes):
+                        break
+                    try:
+                        self._remove_file(existing)
+                    except OSError:
+                        break  # the file is open on Windows
+                    removed += 1
+                sizes.pop_oldest()
+            return removed
+
+    def wait_compressed(self):
+        """Blocks until the files queued for background compression are
+        compressed. Does nothing if the compression is not in background."""
+        if self._compressor is not None:
+            self._compressor.wait()
+
     def _file_for_appending(self) -> Path:
         """Если файл с максимальным числовым именем не особо большой,
         возвращаем его. Иначе возвращаем новое имя файла.
@@ -128,39 +622,538 @@ class LinesDir(Iterable[str]):
         if self._compressed_before_or_just_now(last):
             # we cannot append to last file, so we'll return a new
             # name (for a file that does not exist yet)
-            return NumberedFilePath.from_path(last, subdirs=self._subdirs) \
-                .next.path
+            return self._raw_path(self._file_num(last) + 1)
         # file is ok
         assert is_rawdata_path(last)
         return last
 
+    def _append_locked(self, data: bytes):
+        """Appends whole lines, while other processes may be appending to
+        the same directory.
+
+        Usually the data is written with a single write to a file opened for
+        appending, holding only a shared lock. Starting a new file and
+        writing large data requires the exclusive lock."""
+        assert self._dir_lock is not None
+        if len(data) <= _ATOMIC_APPEND_SIZE:
+            with self._dir_lock.shared():
+                last = self._numerically_last_file()
+                if last is not None and is_rawdata_path(last) \
+                        and last.stat().st_size < self.max_file_size:
+                    _write_appending(last, data,
+                                     fsync=self._sync.after_batch())
+                    return
+        full: Optional[Path] = None
+        with self._dir_lock.exclusive():
+            last = self._numerically_last_file()
+            if last is None:
+                path = NumberedFilePath(
+                    self._path, [0] * (self._subdirs + 1), ".txt").path
+            elif is_compressed_path(last) \
+                    or last.stat().st_size >= self.max_file_size:
+                if not is_compressed_path(last):
+                    full = last
+                path = self._raw_path(self._file_num(last) + 1)
+            else:
+                path = last
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _write_appending(path, data, fsync=self._sync.after_batch())
+            if path != last:
+                self._sync_created(path)
+            self._file_created(path)
+        if full is not None:
+            # no one appends to the file after the next one is created
+            with timed(self.observer, 'rollover'):
+                self._compress(full)
+
+    def _count_appended(self, lines: int, size: int):
+        assert self.observer is not None
+        self.observer.count('lines_in', lines)
+        self.observer.count('bytes_in', size)
+
     def append(self, text: str):
+        if self.observer is None:
+            self._append(text)
+            return
+        started = time.perf_counter()
+        self._append(text)
+        self.observer.timing('append', time.perf_counter() - started)
+        self._count_appended(1, len(encode_line(text)))
+
+    def _append(self, text: str):
+        if self._dir_lock is not None:
+            self._append_locked(encode_line(text))
+            return
+        data = encode_line(text)
         path = self._file_for_appending()
-        path.parent.mkdir(parents=True, exist_ok=True)
-        LinesFile(path).append(text)
+        # the codecs are checked when the file is rolled over, so the
+        # resolved raw file is written directly
+        created = not path.exists()
+        if created:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        _write_appending(path, data, fsync=self._sync.after_batch())
+        if created:
+            self._sync_created(path)
+        self._file_created(path)
+
+    def append_many(self, lines: Iterable[str]):
+        """Appends lines in a single pass.
 
-    def _iter(self, binary: bool, reverse: bool = False) \
+        Unlike calling `append` for each line, the file for appending is
+        resolved only once, and the data is written in large chunks. When
+        the file reaches `max_file_size`, it is compressed and the writing
+        continues to the next file.
+
+        With `multiprocess=True` the lines are written in batches that are
+        not mixed with the lines of other processes.
+        """
+        if self._dir_lock is not None:
+            for batch in _batches(lines, _ATOMIC_APPEND_SIZE):
+                self._append_locked(batch)
+                if self.observer is not None:
+                    self._count_appended(batch.count(b'\n'), len(batch))
+            return
+        with self.writer() as writer:
+            writer.append_many(lines)
+
+    def writer(self) -> LinesDirWriter:
+        """Returns a writer that keeps the current file open between
+        appends. It is intended to be used as a context manager.
+
+        The writer cannot be used with `multiprocess=True`."""
+        if self._dir_lock is not None:
+            raise ValueError("The writer requires a single writing process")
+        return LinesDirWriter(self)
+
+    def group_writer(self, max_latency: float = 0.005,
+                     max_batch: int = 1000,
+                     max_queued: Optional[int] = None,
+                     fsync: bool = False) -> GroupCommitWriter:
+        """Returns a writer that can be shared by many threads. The lines
+        are written by a background thread in batches. It is intended to be
+        used as a context manager."""
+        return GroupCommitWriter(self.writer(), max_latency=max_latency,
+                                 max_batch=max_batch, max_queued=max_queued,
+                                 fsync=fsync)
+
+    def _iter(self, binary: bool, reverse: bool = False, start: int = 0) \
             -> Union[Iterable[str], Iterable[bytes]]:
-        for file in self._recurse_files(reverse=reverse):
-            lf = LinesFile(file)
+        if reverse and start:
+            raise ValueError("Cannot start reversed iteration from a line")
+        files: Iterable[Path]
+        if start:
+            files, skip = self._files_from_line(start)
+        else:
+            files, skip = self._recurse_files(reverse=reverse), 0
+        for file in files:
+            lf = self._reading(file)
 
             file_iterable = \
-                lf.iter_byte_lines() if binary else lf.iter_str_lines()
-            if reverse:
-                file_iterable = reversed(list(file_iterable))
+                lf.iter_byte_lines(reverse=reverse, start=skip) if binary \
+                else lf.iter_str_lines(reverse=reverse, start=skip)
+            skip = 0
             for line in file_iterable:
                 yield line  # type: ignore
 
-    def iter_byte_lines(self, reverse: bool = False) -> Iterable[bytes]:
-        # todo test
-        return self._iter(binary=True, reverse=reverse)  # type: ignore
+    def iter_with_cursors(self, after: Optional[Cursor] = None,
+                          binary: bool = False) \
+            -> Iterable[Tuple[Union[str, bytes], Cursor]]:
+        """Yields the lines, each with the cursor pointing right after it.
+
+        A saved cursor passed as `after` resumes the iteration from the next
+        line. Only the file of the cursor is read, and for an indexed
+        compressed file only from the restart point before the offset.
 
-    def iter_str_lines(self, reverse: bool = False) -> Iterable[bytes]:
-        # todo test
-        return self._iter(binary=False, reverse=reverse)  # type: ignore
+        An unfinished line at the end of the raw last file is not yielded,
+        so the cursors always point to the line boundaries."""
+        files = self._recurse_files(reverse=False,
+                                    start=None if after is None
+                                    else after.num)
+        for file in files:
+            num = self._file_num(file)
+            pos = after.offset if after is not None and num == after.num \
+                else 0
+            lf = self._reading(file)
+            for block in lf.iter_blocks_from(pos):
+                finished = block.endswith(b'\n')
+                if not finished and not lf.is_compressed:
+                    break  # the line is being written
+                lines = _without_last_newline(block).split(b'\n')
+                for i, line in enumerate(lines):
+                    pos += len(line)
+                    if finished or i < len(lines) - 1:
+                        pos += 1
+                    yield (line if binary else line.decode('utf-8'),
+                           Cursor(num, pos))
+
+    def iter_byte_lines(self, reverse: bool = False, start: int = 0) \
+            -> Iterable[bytes]:
+        """Yields the lines starting from the line number `start`.
+
+        The numbers of lines in the compressed files are saved, so finding
+        the start line does not require reading the preceding files."""
+        return self._iter(binary=True, reverse=reverse,  # type: ignore
+                          start=start)
+
+    def iter_str_lines(self, reverse: bool = False, start: int = 0) \
+            -> Iterable[str]:
+        """Yields the lines starting from the line number `start`.
+
+        The numbers of lines in the compressed files are saved, so finding
+        the start line does not require reading the preceding files."""
+        return self._iter(binary=False, reverse=reverse,  # type: ignore
+                          start=start)
+
+    def iter_chunks(self, start: int = 0) -> Iterable[bytes]:
+        """Yields the lines from the line number `start` in large blocks.
+        Each block holds whole lines, each line ending with a newline,
+        except for an unfinished line at the end of the last file.
+
+        A consumer that handles many lines at once (for example, with
+        `bytes.split`) avoids creating an object for each line."""
+        files: Iterable[Path]
+        if start:
+            files, skip = self._files_from_line(start)
+        else:
+            files, skip = self._recurse_files(reverse=False), 0
+        for file in files:
+            yield from self._reading(file).iter_chunks(start=skip)
+            skip = 0
+
+    def grep(self, pattern: PatternArg, binary: bool = True,
+             tokens: Optional[Iterable[Union[str, bytes]]] = None) \
+            -> Union[Iterable[bytes], Iterable[str]]:
+        """Yields the lines containing a match of the regular expression,
+        from oldest to newest.
+
+        The expression is searched in large blocks of the decompressed
+        data rather than line by line. With `binary=True` the lines are
+        `bytes`, and a `str` pattern is encoded to UTF-8. The `^` and `$`
+        match at the start and the end of each line.
+
+        `tokens` are the whole words that each matching line contains. The
+        files whose sketches show that they lack any of the tokens are
+        skipped without decompressing."""
+        required = _query_tokens(tokens or [])
+        for file in self._recurse_files(reverse=False):
+            lf = self._reading(file)
+            if required and not lf.may_contain_tokens(required):
+                continue
+            yield from lf.grep(pattern, binary=binary)
+
+    def rebuild_sketches(self, force: bool = False) -> int:
+        """Saves the sketches for the compressed files that do not have
+        them, or for all the compressed files if `force` is True. Returns
+        the number of sketches saved."""
+        saved = 0
+        for file in self._recurse_files(reverse=False):
+            lf = LinesFile(file, cleanup=False)
+            if not lf.is_compressed:
+                continue
+            sketch_path = to_sketch_path(
+                lf.path, _codec_suffix(lf.path.name) or '')
+            if force or not sketch_path.exists():
+                lf.build_sketch().save(sketch_path)
+                saved += 1
+        return saved
+
+    def iter_range(self, low: Any, high: Any) -> Iterable[str]:
+        """Yields the lines with `low <= key(line) < high`, where `key` is
+        the function passed to the constructor.
+
+        The minimum and the maximum keys of each file are saved when the
+        file is compressed. The files that cannot contain the keys from the
+        range are skipped without decompressing. As the lines are usually
+        appended in the order of the keys, this skips almost all the files.
+        """
+        if self.key is None:
+            raise ValueError("The key function is not set")
+        key = self.key
+        for file in self._files_in_range(low, high):
+            for line in self._reading(file) \
+                    .iter_str_lines():
+                k = key(line)
+                if k is not None and low <= k < high:
+                    yield line
+
+    def parallel_map(self, func: Callable[[Iterable[Any]], T],
+                     workers: Optional[int] = None,
+                     ordered: bool = True,
+                     binary: bool = False) -> Iterable[T]:
+        """Calls `func` for the lines of each file and yields the results.
+
+        The files are decompressed and processed in a pool of `workers`
+        processes (by default, one per CPU). So `func` must be picklable:
+        a function defined at the top level of a module. It receives an
+        iterable of `str` lines, or `bytes` lines if `binary` is True.
+
+        With `ordered=True` the results are yielded in the order of the
+        files, otherwise as soon as they are ready."""
+        return parallel_map(func, self._recurse_files(reverse=False),
+                            binary=binary, workers=workers, ordered=ordered)
+
+    def parallel_iter(self, workers: Optional[int] = None,
+                      ordered: bool = True,
+                      binary: bool = False) \
+            -> Union[Iterable[str], Iterable[bytes]]:
+        """Yields all the lines, decompressing the files in a pool of
+        processes. With `ordered=False` the lines of each file stay in
+        order, but the files may come in any order."""
+        for lines in self.parallel_map(list, workers=workers, ordered=ordered,
+                                       binary=binary):
+            yield from lines
+
+    def __getitem__(self, index: int) -> str:
+        lines: Iterable[str]
+        if index < 0:
+            lines = itertools.islice(self.iter_str_lines(reverse=True),
+                                     -index - 1, None)
+        else:
+            lines = self.iter_str_lines(start=index)
+        for line in lines:
+            return line
+        raise IndexError(index)
+
+    def _follow_start(self, start: Union[int, Cursor, None]) \
+            -> Tuple[int, int, int]:
+        """Returns the number of the file and the byte offset in it, from
+        which to follow, and the number of lines to skip from there."""
+        if isinstance(start, Cursor):
+            return start.num, start.offset, 0
+        if start is not None:
+            return self._follow_start_line(start)
+        last = self._numerically_last_file()
+        if last is None:
+            return 0, 0, 0
+        lf = LinesFile(last, cleanup=False)
+        if lf.is_compressed:
+            return self._file_num(last) + 1, 0, 0
+        return self._file_num(last), _end_of_whole_lines(lf), 0
+
+    def _follow_start_line(self, line: int) -> Tuple[int, int, int]:
+        first = next(iter(self._recurse_files(reverse=False)), None)
+        if first is None:
+            return 0, 0, line
+        num, line = self._line_counts.find(self._file_num(first), line)
+        last: Optional[Tuple[Path, int]] = None
+        for file in self._recurse_files(reverse=False, start=num):
+            count = self._count_lines(file)
+            if line < count:
+                return self._file_num(file), \
+                    LinesFile(file, cleanup=False).offset_of_line(line), 0
+            line -= count
+            last = file, count
+        # the line is not written yet: skipping the lines before it
+        if last is None:
+            return num, 0, line
+        file, count = last
+        if is_compressed_path(file):
+            return self._file_num(file) + 1, 0, line
+        # the raw file may grow meanwhile, so it is read from the start
+        return self._file_num(file), 0, line + count
+
+    def follow(self, start: Union[int, Cursor, None] = None,
+               binary: bool = False,
+               poll_interval: float = 0.5) \
+            -> Union[Iterable[str], Iterable[bytes]]:
+        """Yields the lines as they are appended, like `tail -F`. The
+        iteration never ends by itself.
+
+        Without `start` only the lines appended after the call are
+        yielded. Otherwise the lines are yielded from the line number
+        `start`, or after the `Cursor`. If the line `start` is not written
+        yet, the following waits for it.
+
+        The position is kept as a byte offset in the current file, so only
+        the new data is read. Once the next file appears, nothing is
+        appended to the current one: its rest is read, and the following
+        continues from the start of the next file.
+
+        On Linux the changes are noticed at once with inotify. Otherwise
+        the files are checked every `poll_interval` seconds."""
+        # the position is taken now, not when the iteration starts
+        num, offset, skip = self._follow_start(start)
+        return self._follow(num, offset, skip, binary=binary,
+                            poll_interval=poll_interval)
+
+    def _follow(self, num: int, offset: int, skip: int, binary: bool,
+                poll_interval: float) \
+            -> Union[Iterable[str], Iterable[bytes]]:
+        with ChangeWaiter() as waiter:
+            while True:
+                # checking before reading, so the data read is complete
+                complete = self._existing_file(num + 1) is not None
+                file = self._existing_file(num)
+                blocks: List[bytes] = []
+                if file is not None:
+                    lf = LinesFile(file, cleanup=False)
+                    if self.observer is not None:
+                        self.observer.count('segment_open')
+                    complete = complete or lf.is_compressed
+                    # not yielding while the file is open, so it can be
+                    # compressed and removed meanwhile
+                    for block in lf.iter_blocks_from(offset):
+                        if not block.endswith(b'\n') and not complete:
+                            break  # the line is being written
+                        blocks.append(block)
+                        offset += len(block)
+                for block in blocks:
+                    block = _without_last_newline(block)
+                    if skip:
+                        parts = block.split(b'\n', skip)
+                        if len(parts) <= skip:
+                            skip -= len(parts)
+                            continue
+                        block = parts[skip]
+                        skip = 0
+                    if binary:
+                        yield from block.split(b'\n')
+                    else:
+                        yield from block.decode('utf-8').split('\n')
+                if complete:
+                    num += 1
+                    offset = 0
+                    continue
+                if not blocks:
+                    raw = self._raw_path(num)
+                    waiter.watch(self._path / parent for parent in
+                                 raw.relative_to(self._path).parents)
+                    waiter.wait(poll_interval)
 
     def __iter__(self):
         return self.iter_str_lines()
 
     def __reversed__(self):
         return self.iter_str_lines(reverse=True)
+
+
+def _query_tokens(tokens: Iterable[Union[str, bytes]]) -> List[bytes]:
+    result = []
+    for token in tokens:
+        data = token.encode('utf-8') if isinstance(token, str) else token
+        if tokens_of(data) != {data}:
+            raise ValueError(f"Not a single token: {token!r}")
+        result.append(data)
+    return result
+
+
+class LinesDirWriter:
+    """Appends lines to a `LinesDir`, keeping the current raw file open.
+
+    The directory tree is searched only when the first line is written and
+    when the current file is full. The size of the current file is tracked
+    in memory, so an append costs the same regardless of how many files the
+    directory already holds.
+
+    The data is buffered. It becomes visible to readers after `flush` or
+    `close`.
+
+    The writer assumes it is the only one writing to the directory.
+    """
+
+    def __init__(self, lines_dir: LinesDir):
+        self._dir = lines_dir
+        self._path: Optional[Path] = None
+        self._file: Optional[BinaryIO] = None
+        self._size = 0
+        self._chunk: List[bytes] = []
+        self._chunk_size = 0
+
+    @property
+    def current_file(self) -> Optional[Path]:
+        return self._path
+
+    def _open(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._path = path
+        self._file = path.open('ab')
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._dir._sync_created(path)
+        self._dir._file_created(path)
+
+    def _write_chunk(self):
+        if self._chunk:
+            assert self._file is not None
+            self._file.write(b''.join(self._chunk))
+            self._chunk = []
+            self._chunk_size = 0
+
+    def _sync_file(self):
+        assert self._file is not None
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._write_chunk()
+                if self._dir._sync.syncs:
+                    self._sync_file()
+            finally:
+                self._file.close()
+                self._file = None
+
+    def _rollover(self):
+        assert self._path is not None
+        with timed(self._dir.observer, 'rollover'):
+            self._close_file()
+            self._dir._compress(self._path)
+            self._open(NumberedFilePath.from_path(
+                self._path, subdirs=self._dir._subdirs).next.path)
+
+    def _ready_file(self):
+        if self._file is None:
+            self._open(self._dir._file_for_appending())
+        elif self._size >= self._dir.max_file_size:
+            self._rollover()
+
+    def _add(self, data: bytes):
+        if self._dir.observer is not None:
+            self._dir._count_appended(1, len(data))
+        self._chunk.append(data)
+        self._chunk_size += len(data)
+        self._size += len(data)
+        if self._chunk_size >= _WRITE_CHUNK_SIZE:
+            self._write_chunk()
+
+    def append(self, text: str):
+        data = encode_line(text)
+        self._ready_file()
+        self._add(data)
+        if self._dir._sync.after_line():
+            self._write_chunk()
+            self._sync_file()
+
+    def append_many(self, lines: Iterable[str]):
+        for text in lines:
+            self.append(text)
+
+    def _write_batch(self, batch: List[bytes], fsync: bool = False):
+        """Writes the encoded lines and flushes the file."""
+        for data in batch:
+            self._ready_file()
+            self._add(data)
+        if self._file is not None:
+            self._write_chunk()
+            if fsync or self._dir._sync.after_batch():
+                self._sync_file()
+            else:
+                self._file.flush()
+
+    def flush(self):
+        if self._file is not None:
+            self._write_chunk()
+            if self._dir._sync.after_batch():
+                self._sync_file()
+            else:
+                self._file.flush()
+
+    def close(self):
+        self._close_file()
+
+    def __enter__(self) -> LinesDirWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
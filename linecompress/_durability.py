@@ -0,0 +1,73 @@
+"""When the written data is synced to the disk.
+
+- 'none': never. The data reaches the disk when the OS decides to write it,
+  so a power loss may lose the recent lines, and even leave a compressed
+  file empty.
+- 'batch': after each `LinesDir.append` and `append_many` call, and each
+  `flush` of a writer.
+- 'line': after each line. For the group writer, a batch is synced as a
+  whole.
+- 'interval': on the first write after `interval` seconds have passed since
+  the last sync, and on closing a writer.
+
+In all the modes except 'none' a compressed file is synced before it
+replaces the raw one, and the directory is synced after the rename.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from pathlib import Path
+
+DURABILITY_MODES = ('none', 'batch', 'line', 'interval')
+
+
+def fsync_dir(path: Path):
+    """Makes the created, renamed and removed entries of the directory
+    durable. Does nothing where a directory cannot be opened (Windows)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SyncPolicy:
+    def __init__(self, mode: str = 'none', interval: float = 1.0):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {mode!r}")
+        if interval < 0:
+            raise ValueError(interval)
+        self.mode = mode
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+
+    @property
+    def syncs(self) -> bool:
+        return self.mode != 'none'
+
+    def _due(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_sync < self.interval:
+                return False
+            self._last_sync = now
+            return True
+
+    def after_line(self) -> bool:
+        """Whether to sync after writing a line in the middle of a batch."""
+        if self.mode == 'line':
+            return True
+        return self.mode == 'interval' and self._due()
+
+    def after_batch(self) -> bool:
+        """Whether to sync at the end of a batch."""
+        if self.mode in ('line', 'batch'):
+            return True
+        return self.mode == 'interval' and self._due()
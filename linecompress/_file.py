@@ -1,39 +1,253 @@
-import gzip
+import mmap
 import os
-import shutil
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable, Union, BinaryIO
+from typing import Callable, Iterable, Iterator, List, BinaryIO, \
+    Optional, Set, Tuple, Union
+
+from linecompress._codecs import Codec, GzipCodec, CODEC_SUFFIXES, \
+    codec_for_suffix
+from linecompress._durability import fsync_dir
+from linecompress._grep import PatternArg, compile_pattern, matching_lines
+from linecompress._index import MembersIndex, IndexPoint
+from linecompress._locks import lock_fd, remove_if_unlocked, \
+    CAN_RENAME_LOCKED
+from linecompress._reverse import _reversed_lines, _raw_blocks_from_end, \
+    _gzip_blocks_from_end, _spooled_blocks_from_end
+from linecompress._sketch import TokenSketch, tokens_of
 
-_COMPRESSED_SUFFIX = '.txt.gz'
 _DECOMPRESSED_SUFFIX = '.txt'
-_DIRTY_SUFFIX = '.txt.gz.tmp'
+_DEFAULT_CODEC_SUFFIX = GzipCodec.suffix
+_TEMP_SUFFIX = '.tmp'
+_INDEX_SUFFIX = '.idx'
+_SKETCH_SUFFIX = '.bloom'
+
+
+def encode_line(data: str) -> bytes:
+    if '\n' in data:
+        raise ValueError('Newline in the data')
+    return data.encode('utf-8') + b'\n'
+
+
+_READ_CHUNK_SIZE = 1 << 18
+
+
+def _line_blocks(f: BinaryIO, chunk_size: int = _READ_CHUNK_SIZE) \
+        -> Iterable[bytes]:
+    """Reads the stream in chunks and yields blocks of whole lines. Each
+    block ends with a newline, except for the last one if the stream does
+    not end with a newline.
+
+    Only one chunk (plus an unfinished line) is in memory at a time.
+    """
+    tail: List[bytes] = []
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        last_newline = chunk.rfind(b'\n')
+        if last_newline < 0:
+            tail.append(chunk)
+            continue
+        tail.append(chunk[:last_newline + 1])
+        yield b''.join(tail)
+        tail = [chunk[last_newline + 1:]]
+    rest = b''.join(tail)
+    if rest:
+        yield rest
+
+
+def _written(blocks: Iterable[bytes], target: BinaryIO) -> Iterable[bytes]:
+    """Writes the blocks to the stream, yielding each block."""
+    for block in blocks:
+        target.write(block)
+        yield block
+
+
+def _line_views(data: Union[bytes, mmap.mmap], view: memoryview) \
+        -> Iterable[memoryview]:
+    """Yields the slices of the `view` of the `data` between the newlines.
+    The newlines are searched in the `data`, since a view cannot search."""
+    find = data.find
+    pos = 0
+    end = len(view)
+    while pos < end:
+        newline = find(b'\n', pos)
+        if newline < 0:
+            yield view[pos:]
+            return
+        yield view[pos:newline]
+        pos = newline + 1
+
+
+def _skip_bytes(f: BinaryIO, size: int):
+    """Skips the data of a stream that may not support seeking."""
+    while size > 0:
+        skipped = len(f.read(min(size, _READ_CHUNK_SIZE)))
+        if skipped == 0:
+            break
+        size -= skipped
+
+
+def _without_last_newline(block: bytes) -> bytes:
+    """Removes the trailing newline, so that the block can be split into
+    lines with `split`."""
+    return block[:-1] if block.endswith(b'\n') else block
+
+
+def _skip_lines(blocks: Iterable[bytes], count: int) -> Iterable[bytes]:
+    """Yields the blocks of lines without the first `count` lines."""
+    for block in blocks:
+        if count > 0:
+            lines_in_block = block.count(b'\n')
+            if not block.endswith(b'\n'):
+                lines_in_block += 1
+            if count >= lines_in_block:
+                count -= lines_in_block
+                continue
+            block = block.split(b'\n', count)[-1]
+            count = 0
+        yield block
+
+
+def _line_aligned_parts(blocks: Iterable[bytes], size: int) \
+        -> Iterable[bytes]:
+    """Joins the blocks of lines into parts of at least `size` bytes (except
+    the last one). There is always at least one part, maybe empty."""
+    part: List[bytes] = []
+    part_size = 0
+    for block in blocks:
+        part.append(block)
+        part_size += len(block)
+        if part_size >= size:
+            yield b''.join(part)
+            part = []
+            part_size = 0
+    if part or part_size == 0:
+        yield b''.join(part)
+
+
+class CompressedElsewhere(Exception):
+    """The file is being compressed, or has just been compressed, by
+    another process or thread."""
+
+
+def _compress_to_members(blocks: Iterable[bytes], out: BinaryIO, span: int,
+                         codec: Codec) -> MembersIndex:
+    """Compresses the blocks of lines as a sequence of independently
+    compressed members, each holding at least `span` bytes of whole
+    lines."""
+    points: List[IndexPoint] = []
+    line = 0
+    out_offset = 0
+    data = b''
+    for data in _line_aligned_parts(blocks, span):
+        points.append(IndexPoint(out.tell(), out_offset, line))
+        out.write(codec.compress(data))
+        out_offset += len(data)
+        line += data.count(b'\n')
+    if data and not data.endswith(b'\n'):
+        line += 1
+    compressed_size = out.tell()
+    return MembersIndex(points=points, lines=line, size=out_offset,
+                        compressed_size=compressed_size)
+
+
+def _remove_if_exists(file: Path):
+    try:
+        os.remove(file)
+    except FileNotFoundError:
+        pass
+
+
+def _count_lines(blocks: Iterable[bytes]) -> int:
+    count = 0
+    last = b''
+    for block in blocks:
+        count += block.count(b'\n')
+        last = block
+    if last and not last.endswith(b'\n'):
+        count += 1
+    return count
+
+
+def _codec_suffix(basename: str) -> Optional[str]:
+    """Returns the suffix of the codec for names like `000.txt.gz`."""
+    for suffix in CODEC_SUFFIXES:
+        if basename.endswith(_DECOMPRESSED_SUFFIX + suffix):
+            return suffix
+    return None
 
 
 def _remove_suffix(basename: str) -> str:
-    for suf in [_COMPRESSED_SUFFIX, _DECOMPRESSED_SUFFIX, _DIRTY_SUFFIX]:
-        if basename.endswith(suf):
-            return basename[:-len(suf)]
-    raise ValueError
+    for extra in [_TEMP_SUFFIX, _INDEX_SUFFIX, _SKETCH_SUFFIX]:
+        if basename.endswith(extra):
+            basename = basename[:-len(extra)]
+    suffix = _codec_suffix(basename)
+    if suffix is not None:
+        basename = basename[:-len(suffix)]
+    if not basename.endswith(_DECOMPRESSED_SUFFIX):
+        raise ValueError
+    return basename[:-len(_DECOMPRESSED_SUFFIX)]
 
 
-def to_compressed_path(file: Path) -> Path:
-    return file.parent / (_remove_suffix(file.name) + _COMPRESSED_SUFFIX)
+def to_compressed_path(file: Path,
+                       suffix: str = _DEFAULT_CODEC_SUFFIX) -> Path:
+    return file.parent / (_remove_suffix(file.name) + _DECOMPRESSED_SUFFIX
+                          + suffix)
 
 
-def to_dirty_path(file: Path) -> Path:
-    return file.parent / (_remove_suffix(file.name) + _DIRTY_SUFFIX)
+def to_dirty_path(file: Path, suffix: str = _DEFAULT_CODEC_SUFFIX) -> Path:
+    return file.parent / (to_compressed_path(file, suffix).name
+                          + _TEMP_SUFFIX)
+
+
+def to_index_path(file: Path, suffix: str = _DEFAULT_CODEC_SUFFIX) -> Path:
+    return file.parent / (to_compressed_path(file, suffix).name
+                          + _INDEX_SUFFIX)
+
+
+def to_sketch_path(file: Path, suffix: str = _DEFAULT_CODEC_SUFFIX) -> Path:
+    return file.parent / (to_compressed_path(file, suffix).name
+                          + _SKETCH_SUFFIX)
 
 
 def to_rawdata_path(file: Path) -> Path:
     return file.parent / (_remove_suffix(file.name) + _DECOMPRESSED_SUFFIX)
 
 
+def compressed_paths(file: Path) -> List[Path]:
+    """Returns the possible names of the compressed file in all formats.
+    If the `file` is compressed, its own name goes first."""
+    own = _codec_suffix(file.name)
+    suffixes = CODEC_SUFFIXES if own is None \
+        else [own] + [s for s in CODEC_SUFFIXES if s != own]
+    return [to_compressed_path(file, s) for s in suffixes]
+
+
 def is_compressed_path(file: Path) -> bool:
-    return file.name.endswith(_COMPRESSED_SUFFIX)
+    return _codec_suffix(file.name) is not None
+
+
+def _is_dirty_name(name: str) -> bool:
+    return name.endswith(_TEMP_SUFFIX) \
+        and _codec_suffix(name[:-len(_TEMP_SUFFIX)]) is not None
+
+
+def _is_sidecar_name(name: str) -> bool:
+    if name.endswith(_TEMP_SUFFIX):
+        name = name[:-len(_TEMP_SUFFIX)]
+    return name.endswith(_INDEX_SUFFIX) or name.endswith(_SKETCH_SUFFIX)
 
 
 def is_dirty_path(file: Path) -> bool:
-    return file.name.endswith(_DIRTY_SUFFIX)
+    return _is_dirty_name(file.name)
+
+
+def is_sidecar_path(file: Path) -> bool:
+    """Returns True for the index and sketch files and their temporary
+    versions."""
+    return _is_sidecar_name(file.name)
 
 
 def is_rawdata_path(file: Path) -> bool:
@@ -41,44 +255,153 @@ def is_rawdata_path(file: Path) -> bool:
 
 
 class LinesFile(Iterable[str]):
-    def __init__(self, file: Path):
-
-        dirty = to_dirty_path(file)
-        if dirty.exists():
-            os.remove(dirty)
+    def __init__(self, file: Path, cleanup: bool = True):
+        """With `cleanup=True` the leftovers of interrupted compression are
+        removed. Readers that may run while the file is being compressed
+        (by another thread) should pass `cleanup=False`.
+
+        The file may be compressed in any of the supported formats: it is
+        found by the suffix."""
+
+        candidates = compressed_paths(file)
+        if cleanup:
+            for compressed in candidates:
+                dirty = compressed.parent / (compressed.name + _TEMP_SUFFIX)
+                if dirty.exists():
+                    # the file is locked while it is being written
+                    remove_if_unlocked(dirty)
 
-        compressed = to_compressed_path(file)
         raw = to_rawdata_path(file)
-
-        if compressed.exists():
-            self._file = compressed
-            assert self.is_compressed
-            if raw.exists():
-                os.remove(raw)
-
+        self._file = raw
+        for compressed in candidates:
+            if compressed.exists():
+                self._file = compressed
+                assert self.is_compressed
+                if cleanup:
+                    _remove_if_exists(raw)
+                break
         else:
-            self._file = raw
             assert not self.is_compressed
 
+    @property
+    def path(self) -> Path:
+        """The file as it is on the disk: raw or compressed."""
+        return self._file
+
     @property
     def is_compressed(self) -> bool:
-        return self._file.name.endswith(_COMPRESSED_SUFFIX)
+        return is_compressed_path(self._file)
 
-    def compress(self):
+    @property
+    def codec(self) -> Optional[Codec]:
+        """The codec for reading the compressed file. None if the file is
+        not compressed."""
+        suffix = _codec_suffix(self._file.name)
+        return None if suffix is None else codec_for_suffix(suffix)
+
+    def compress(self, index_span: Optional[int] = None,
+                 codec: Optional[Codec] = None,
+                 sketch: bool = False, fsync: bool = False,
+                 inspect: Optional[Callable[[bytes], None]] = None) -> int:
+        """Compresses the file and returns the number of lines in it.
+        The default codec is gzip with the maximum compression level.
+
+        With `index_span` the data is written as independent members
+        of about `index_span` bytes each, and a sidecar index is saved next
+        to the compressed file. The index allows reading from an arbitrary
+        line or offset without decompressing the file from the start.
+
+        With `sketch=True` a bloom filter of the tokens is saved next to
+        the compressed file, so that searches can skip the file.
+
+        With `fsync=True` the compressed file is synced to the disk before
+        it replaces the raw one, and the directory is synced after that.
+
+        `inspect` is called with each block of whole lines as it is
+        compressed, so the caller can gather more facts about the lines
+        without reading the file again.
+
+        Raises `CompressedElsewhere` if another process or thread is
+        compressing the same file."""
         if self.is_compressed:
             # todo test
             raise Exception("Cannot compress already compressed")
+        if index_span is not None and index_span < 1:
+            raise ValueError(index_span)
+        if codec is None:
+            codec = GzipCodec()
+
+        temp_name = to_dirty_path(self._file, codec.suffix)
+        compressed_name = to_compressed_path(self._file, codec.suffix)
+        index_name = to_index_path(self._file, codec.suffix)
+        sketch_name = to_sketch_path(self._file, codec.suffix)
+
+        # The temporary file is locked while being written. So concurrent
+        # compressions of the same file do not mix their output, and the
+        # cleanup does not remove the file being written.
+        fd = os.open(temp_name, os.O_RDWR | os.O_CREAT
+                     | getattr(os, 'O_BINARY', 0), 0o666)
+        with os.fdopen(fd, 'r+b') as out:
+            if not lock_fd(out.fileno(), blocking=False):
+                raise CompressedElsewhere(self._file)
+            if compressed_name.exists():
+                # we created a new temporary file after the rename
+                out.close()
+                _remove_if_exists(temp_name)
+                raise CompressedElsewhere(self._file)
+            out.truncate(0)
+            for leftover in [index_name, sketch_name]:
+                # a leftover of an interrupted compression
+                _remove_if_exists(leftover)
+            tokens: Set[bytes] = set()
+
+            def inspected(blocks: Iterable[bytes]) -> Iterable[bytes]:
+                for block in blocks:
+                    if sketch:
+                        tokens.update(tokens_of(block))
+                    if inspect is not None:
+                        inspect(block)
+                    yield block
 
-        temp_name = to_dirty_path(self._file)
-        compressed_name = to_compressed_path(self._file)
-        with gzip.open(temp_name, 'wb') as lzma_out:
             with self._file.open('rb') as text_in:
-                shutil.copyfileobj(text_in, lzma_out)
-        os.rename(temp_name, compressed_name)
-        os.remove(self._file)
+                if index_span is None:
+                    with codec.writer(out) as compressed_out:  # type: ignore
+                        blocks = inspected(_line_blocks(text_in))
+                        lines = _count_lines(
+                            _written(blocks, compressed_out))
+                else:
+                    blocks = inspected(_line_blocks(
+                        text_in, min(index_span, _READ_CHUNK_SIZE)))
+                    index = _compress_to_members(blocks, out,  # type: ignore
+                                                 index_span, codec)
+                    index.save(index_name)
+                    lines = index.lines
+            if sketch:
+                TokenSketch.of_tokens(tokens).save(sketch_name)
+            out.flush()
+            if fsync:
+                os.fsync(out.fileno())
+            if CAN_RENAME_LOCKED:
+                os.rename(temp_name, compressed_name)
+        if not CAN_RENAME_LOCKED:
+            try:
+                os.rename(temp_name, compressed_name)
+            except FileNotFoundError:
+                # the file was unlocked before the rename, and a cleanup in
+                # another process took it for a leftover
+                if compressed_name.exists() or not self._file.exists():
+                    raise CompressedElsewhere(self._file) from None
+                # the lines were inspected by the first attempt
+                return self.compress(index_span=index_span, codec=codec,
+                                     sketch=sketch, fsync=fsync)
+        if fsync:
+            fsync_dir(compressed_name.parent)
+        # the raw file may be removed by a reader that sees both
+        _remove_if_exists(self._file)
         self._file = compressed_name
+        return lines
 
-    def append(self, data: str):
+    def append(self, data: str, fsync: bool = False):
         if self.is_compressed:
             raise Exception("Cannot add to compressed file")
         if '\n' in data:
@@ -87,46 +410,296 @@ class LinesFile(Iterable[str]):
             outfile.write(data)
             outfile.write('\n')
             outfile.flush()
+            if fsync:
+                os.fsync(outfile.fileno())
 
-    def iter_str_lines(self) -> Iterable[str]:
-        f = None
+    def _open_file(self) -> BinaryIO:
+        """Opens the file as it is on the disk, without decompressing."""
         try:
+            return self._file.open("rb")
+        except FileNotFoundError:
             if self.is_compressed:
-                f = gzip.open(self._file, "rt", encoding="utf-8", newline='\n')
-            else:
-                f = self._file.open("rt", encoding="utf-8", newline='\n')
-
-            for line in f.readlines():
-                line = line[:-1]
-                yield line
-
+                raise
+            # the raw file may have been compressed since we checked
+            for compressed in compressed_paths(self._file):
+                if compressed.exists():
+                    self._file = compressed
+                    return self._file.open("rb")
+            raise
+
+    def _load_index(self) -> Optional[MembersIndex]:
+        """Returns the index of the compressed file, if there is a valid
+        one."""
+        index = MembersIndex.load(self._file.parent /
+                                  (self._file.name + _INDEX_SUFFIX))
+        if index is None:
+            return None
+        try:
+            if index.compressed_size != self._file.stat().st_size:
+                return None
         except FileNotFoundError:
-            pass
-        finally:
-            if f is not None:
-                f.close()
-
-    def iter_byte_lines(self) -> Iterable[bytes]:
-        f: Union[BinaryIO, gzip.GzipFile, None] = None
+            return None
+        return index
+
+    def _restart_point(self, line: Optional[int] = None,
+                       offset: Optional[int] = None) -> IndexPoint:
+        """Returns the point in the compressed file from which to start
+        decompressing to get the line or the offset."""
+        start = IndexPoint(0, 0, 0)
+        if self.is_compressed and (line or offset):
+            index = self._load_index()
+            if index is not None:
+                start = index.point_for_line(line) if line is not None \
+                    else index.point_for_offset(offset or 0)
+        return start
+
+    def _iter_line_blocks(self, start: int = 0) -> Iterable[bytes]:
         try:
-            if self.is_compressed:
-                f = gzip.open(self._file, "rb")
+            f = self._open_file()
+        except FileNotFoundError:
+            return
+        with f:
+            codec = self.codec
+            if codec is not None:
+                point = self._restart_point(line=start)
+                f.seek(point.in_offset)
+                with codec.reader(f) as decompressed:
+                    yield from _skip_lines(_line_blocks(decompressed),
+                                           start - point.line)
             else:
-                f = self._file.open("rb")
+                yield from _skip_lines(_line_blocks(f), start)
 
-            for line in f.readlines():
-                line = line[:-1]
-                yield line
+    def count_lines(self) -> int:
+        """Returns the number of lines. For a compressed file with an index
+        the number is taken from the index without decompressing."""
+        if self.is_compressed:
+            index = self._load_index()
+            if index is not None:
+                return index.lines
+        return _count_lines(self._iter_line_blocks())
+
+    def count_text(self) -> Tuple[int, int]:
+        """Returns the number of lines and the size of the text, counted in
+        a single pass. For a compressed file with an index both numbers are
+        taken from the index without decompressing."""
+        if self.is_compressed:
+            index = self._load_index()
+            if index is not None:
+                return index.lines, index.size
+        size = 0
+
+        def sized(blocks: Iterable[bytes]) -> Iterable[bytes]:
+            nonlocal size
+            for block in blocks:
+                size += len(block)
+                yield block
+
+        lines = _count_lines(sized(self._iter_line_blocks()))
+        return lines, size
+
+    def text_size(self) -> int:
+        """Returns the size of the text data. For a compressed file the size
+        is taken from the index. Without the index the file is decompressed:
+        the gzip trailer holds the size of the last member only, and the
+        file may have several."""
+        if not self.is_compressed:
+            return self.size
+        return self.count_text()[1]
+
+    @contextmanager
+    def _text_at(self, offset: int) -> Iterator[BinaryIO]:
+        """Opens the text data positioned at `offset`. For a compressed
+        file with an index only the data from the nearest restart point is
+        decompressed."""
+        with self._open_file() as f:
+            codec = self.codec
+            if codec is None:
+                f.seek(offset)
+                yield f
+                return
+            point = self._restart_point(offset=offset)
+            f.seek(point.in_offset)
+            with codec.reader(f) as decompressed:
+                _skip_bytes(decompressed, offset - point.out_offset)
+                yield decompressed
+
+    def read_bytes(self, offset: int, size: int) -> bytes:
+        """Returns `size` bytes of the text data starting at `offset`."""
+        try:
+            with self._text_at(offset) as f:
+                return f.read(size)
+        except FileNotFoundError:
+            return b''
 
+    def iter_blocks_from(self, offset: int) -> Iterable[bytes]:
+        """Yields the blocks of whole lines starting at the byte `offset`,
+        which should be the start of a line. The last block is an unfinished
+        line, if the data does not end with a newline."""
+        try:
+            with self._text_at(offset) as f:
+                yield from _line_blocks(f)
         except FileNotFoundError:
-            pass
+            return
+
+    def offset_of_line(self, line: int) -> int:
+        """Returns the byte offset at which the line starts. For the
+        lines past the end returns the size of the data."""
+        point = self._restart_point(line=line)
+        offset = point.out_offset
+        count = line - point.line
+        try:
+            with self._text_at(offset) as f:
+                for block in _line_blocks(f):
+                    if count <= 0:
+                        break
+                    newlines = block.count(b'\n')
+                    if newlines >= count:
+                        pos = -1
+                        for _ in range(count):
+                            pos = block.index(b'\n', pos + 1)
+                        return offset + pos + 1
+                    count -= newlines
+                    offset += len(block)
+        except FileNotFoundError:
+            return 0
+        return offset
+
+    def iter_chunks(self, start: int = 0) -> Iterable[bytes]:
+        """Yields the text in large blocks of whole lines, starting from the
+        line number `start`. Each block ends with a newline, except for the
+        last one if the data does not end with a newline.
+
+        This is faster than reading the lines one by one, if the consumer
+        can process many lines at once."""
+        return self._iter_line_blocks(start)
+
+    def _mapped(self) -> Optional[mmap.mmap]:
+        """Maps the raw file to memory. Returns None for a compressed, a
+        missing or an empty file, and on Windows, where a mapped file
+        cannot be removed."""
+        if not CAN_RENAME_LOCKED:
+            return None
+        try:
+            f = self._open_file()
+        except FileNotFoundError:
+            return None
+        with f:
+            if self.is_compressed:
+                return None
+            try:
+                # the mapping keeps its own descriptor
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return None  # empty file cannot be mapped
+
+    def _iter_block_line_views(self) -> Iterable[memoryview]:
+        for block in self._iter_line_blocks():
+            yield from _line_views(block, memoryview(block))
+
+    @contextmanager
+    def line_views(self) -> Iterator[Iterable[memoryview]]:
+        """Returns the lines without newlines as `memoryview` slices, so the
+        lines are not copied. The views must not be used after the `with`
+        block:
+
+            with lines_file.line_views() as views:
+                for view in views:
+                    ...
+
+        A raw file is mapped to memory, and the mapping is closed at the
+        end of the block. A compressed file (or any file on Windows) is
+        read in blocks, and the views refer to the blocks.
+
+        The views pay off for long lines. Short lines are split faster by
+        `iter_byte_lines`, and faster still processed with `iter_chunks`."""
+        mapped = self._mapped()
+        if mapped is None:
+            yield self._iter_block_line_views()
+            return
+        whole = memoryview(mapped)
+        try:
+            yield _line_views(mapped, whole)
         finally:
-            if f is not None:
-                f.close()
+            whole.release()
+            try:
+                mapped.close()
+            except BufferError:
+                # some views are still referenced, the mapping is closed
+                # when they are gone
+                pass
+
+    def _iter_byte_lines_reversed(self) -> Iterable[bytes]:
+        try:
+            f = self._open_file()
+        except FileNotFoundError:
+            return
+        with f:
+            codec = self.codec
+            if codec is None:
+                yield from _reversed_lines(_raw_blocks_from_end(f))
+            elif isinstance(codec, GzipCodec):
+                yield from _reversed_lines(_gzip_blocks_from_end(f))
+            else:
+                with codec.reader(f) as decompressed:
+                    yield from _reversed_lines(
+                        _spooled_blocks_from_end(decompressed))
+
+    def iter_str_lines(self, reverse: bool = False, start: int = 0) \
+            -> Iterable[str]:
+        """Yields the lines starting from the line number `start`."""
+        if reverse and start:
+            raise ValueError("Cannot start reversed iteration from a line")
+        if reverse:
+            for line in self._iter_byte_lines_reversed():
+                yield line.decode('utf-8')
+            return
+        for block in self._iter_line_blocks(start):
+            yield from _without_last_newline(block).decode('utf-8').split('\n')
+
+    def iter_byte_lines(self, reverse: bool = False, start: int = 0) \
+            -> Iterable[bytes]:
+        if reverse and start:
+            raise ValueError("Cannot start reversed iteration from a line")
+        if reverse:
+            yield from self._iter_byte_lines_reversed()
+            return
+        for block in self._iter_line_blocks(start):
+            yield from _without_last_newline(block).split(b'\n')
+
+    def build_sketch(self) -> TokenSketch:
+        return TokenSketch.build(self._iter_line_blocks())
+
+    def load_sketch(self) -> Optional[TokenSketch]:
+        """Returns the sketch of the compressed file, if it was saved."""
+        if not self.is_compressed:
+            return None
+        return TokenSketch.load(self._file.parent /
+                                (self._file.name + _SKETCH_SUFFIX))
+
+    def may_contain_tokens(self, tokens: Iterable[bytes]) -> bool:
+        """Returns False if the sketch shows that some of the tokens are
+        not in the file. Without the sketch, always returns True."""
+        sketch = self.load_sketch()
+        return sketch is None or all(sketch.may_contain(t) for t in tokens)
+
+    def grep(self, pattern: PatternArg, binary: bool = True) \
+            -> Union[Iterable[bytes], Iterable[str]]:
+        """Yields the lines containing a match of the regular expression.
+
+        The expression is searched in large blocks of the decompressed
+        data, and only the matching lines are split out (and decoded if
+        `binary` is False)."""
+        regex = compile_pattern(pattern, binary)
+        for block in self._iter_line_blocks():
+            yield from matching_lines(
+                block if binary else block.decode('utf-8'), regex)
 
     def __iter__(self):
         return self.iter_str_lines()
 
+    def __reversed__(self):
+        return self.iter_str_lines(reverse=True)
+
     @property
     def size(self) -> int:
         try:
@@ -0,0 +1,57 @@
+"""Searching for the lines matching a regular expression.
+
+The expression is applied to a whole block of lines at once, so the search
+runs at the speed of the regex engine. Only the matching lines are cut out
+of the block.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import AnyStr, Iterable, Pattern, Union
+
+PatternArg = Union[str, bytes, Pattern]
+
+
+def compile_pattern(pattern: PatternArg, binary: bool) -> Pattern:
+    """Compiles the pattern for searching in `bytes` blocks if `binary`,
+    and in `str` blocks otherwise.
+
+    The `^` and `$` of a string pattern match at the line boundaries.
+    A compiled pattern is used as is, if its type fits."""
+    if isinstance(pattern, (str, bytes)):
+        if binary and isinstance(pattern, str):
+            pattern = pattern.encode('utf-8')
+        elif not binary and isinstance(pattern, bytes):
+            pattern = pattern.decode('utf-8')
+        return re.compile(pattern, re.MULTILINE)
+    if isinstance(pattern.pattern, bytes) != binary:
+        raise TypeError(f"The pattern must be "
+                        f"{'bytes' if binary else 'str'}: {pattern!r}")
+    return pattern
+
+
+def matching_lines(block: AnyStr, regex: Pattern[AnyStr]) \
+        -> Iterable[AnyStr]:
+    """Yields the lines of the block that contain a match. Each line is
+    yielded once, even if it contains many matches."""
+    newline = b'\n' if isinstance(block, bytes) else '\n'
+    pos = 0
+    while True:
+        m = regex.search(block, pos)
+        if m is None:
+            return
+        start = block.rfind(newline, 0, m.start()) + 1  # type: ignore
+        end = block.find(newline, m.start())  # type: ignore
+        if end < 0:
+            end = len(block)
+        if m.end() > end or m.start() == end:
+            # the match includes the newline, so it may be not in the line
+            matched = regex.search(block, start, end) is not None
+        else:
+            matched = True
+        if matched and start < len(block):
+            yield block[start:end]
+        pos = end + 1
+        if pos > len(block):
+            return
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import TYPE_CHECKING, List, Optional
+
+from linecompress._file import encode_line
+
+if TYPE_CHECKING:
+    from linecompress._dir import LinesDirWriter
+
+
+class GroupCommitWriter:
+    """Appends lines to a `LinesDir` from many threads.
+
+    The producers only put the encoded lines into a queue. A single flusher
+    thread takes the queued lines in batches and writes each batch with one
+    write (and one `fsync`, if requested). So the producers do not wait for
+    each other's writes, and the more of them there are, the larger the
+    batches become.
+
+    A batch is written when it reaches `max_batch` lines, or when its first
+    line has waited for `max_latency` seconds. The producers block when
+    more than `max_queued` lines are waiting.
+    """
+
+    def __init__(self, writer: LinesDirWriter,
+                 max_latency: float = 0.005,
+                 max_batch: int = 1000,
+                 max_queued: Optional[int] = None,
+                 fsync: bool = False):
+        if max_batch < 1:
+            raise ValueError(max_batch)
+        if max_latency < 0:
+            raise ValueError(max_latency)
+        self._writer = writer
+        self._max_latency = max_latency
+        self._max_batch = max_batch
+        self._max_queued = max_queued if max_queued is not None \
+            else max_batch * 4
+        if self._max_queued < 1:
+            raise ValueError(max_queued)
+        self._fsync = fsync
+        self._cond = threading.Condition()
+        self._queue: List[bytes] = []
+        self._queued = 0  # the number of lines ever queued
+        self._written = 0  # the number of lines ever written
+        self._urgent = 0  # the number of threads waiting in `flush`
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='linecompress-flusher')
+        self._thread.start()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+        if self._closed:
+            raise ValueError("The writer is closed")
+
+    def append(self, text: str):
+        data = encode_line(text)
+        with self._cond:
+            self._check()
+            while len(self._queue) >= self._max_queued:
+                self._cond.wait()
+                self._check()
+            self._queue.append(data)
+            self._queued += 1
+            if len(self._queue) == 1 or len(self._queue) >= self._max_batch:
+                self._cond.notify_all()
+
+    def _next_batch(self) -> List[bytes]:
+        """Waits for a batch to be ready. Returns an empty list when the
+        writer is closed and everything is written."""
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            deadline = time.monotonic() + self._max_latency
+            while 0 < len(self._queue) < self._max_batch \
+                    and not self._closed and not self._urgent:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self._max_batch]
+            del self._queue[:self._max_batch]
+            # the producers blocked on the full queue may continue
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                self._writer._write_batch(batch, fsync=self._fsync)
+            except BaseException as e:  # pylint: disable=broad-except
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._written += len(batch)
+                self._cond.notify_all()
+
+    def flush(self):
+        """Blocks until all the lines appended before are written."""
+        with self._cond:
+            target = self._queued
+            self._urgent += 1
+            self._cond.notify_all()
+            try:
+                while self._written < target and self._error is None:
+                    self._cond.wait()
+            finally:
+                self._urgent -= 1
+            if self._error is not None:
+                raise self._error
+
+    def close(self):
+        """Writes the remaining lines and closes the file."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._writer.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> GroupCommitWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
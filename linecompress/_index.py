@@ -0,0 +1,75 @@
+"""Random access to the compressed files.
+
+A compressed file may be written as a sequence of independently compressed
+parts (gzip members, xz streams, zstd frames and so on), each starting at a
+line boundary. Any decompressor reads such a file as a single stream. The
+sidecar index stores the offset of each member in the compressed file
+together with the offset and the number of the first line in the
+decompressed data. So reading from an arbitrary line or byte offset
+requires decompressing only the members from that point.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import os
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+_INDEX_FORMAT_VERSION = 1
+
+
+class IndexPoint(NamedTuple):
+    # offset of the member in the compressed file
+    in_offset: int
+    # offset of the member data in the decompressed stream
+    out_offset: int
+    # number of the first line of the member
+    line: int
+
+
+class MembersIndex:
+    def __init__(self, points: List[IndexPoint], lines: int, size: int,
+                 compressed_size: int):
+        if not points or points[0] != IndexPoint(0, 0, 0):
+            raise ValueError(points)
+        self.points = points
+        self.lines = lines
+        self.size = size
+        self.compressed_size = compressed_size
+        self._lines = [p.line for p in points]
+        self._offsets = [p.out_offset for p in points]
+
+    def point_for_line(self, line: int) -> IndexPoint:
+        """Returns the last restart point before or at the line."""
+        return self.points[bisect.bisect_right(self._lines, line) - 1]
+
+    def point_for_offset(self, offset: int) -> IndexPoint:
+        """Returns the last restart point before or at the offset in the
+        decompressed stream."""
+        return self.points[bisect.bisect_right(self._offsets, offset) - 1]
+
+    def save(self, file: Path):
+        temp = file.parent / (file.name + '.tmp')
+        temp.write_text(json.dumps({
+            'version': _INDEX_FORMAT_VERSION,
+            'lines': self.lines,
+            'size': self.size,
+            'compressed_size': self.compressed_size,
+            'points': [list(p) for p in self.points]}))
+        os.replace(temp, file)
+
+    @staticmethod
+    def load(file: Path) -> Optional[MembersIndex]:
+        """Returns None if the index does not exist or cannot be used."""
+        try:
+            data = json.loads(file.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get('version') != _INDEX_FORMAT_VERSION:
+            return None
+        return MembersIndex(points=[IndexPoint(*p) for p in data['points']],
+                            lines=data['lines'],
+                            size=data['size'],
+                            compressed_size=data['compressed_size'])
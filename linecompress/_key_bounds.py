@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import bisect
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Callable, Iterable
+
+from linecompress._append_log import append_entry, load_entries
+
+Bounds = Optional[Tuple[Any, Any]]
+
+
+def bounds_of(lines: Iterable[str], key: Callable[[str], Any]) -> Bounds:
+    """Returns the minimum and the maximum keys of the lines. The lines with
+    the None key are ignored. Returns None if there are no keys at all."""
+    low = high = None
+    for line in lines:
+        k = key(line)
+        if k is None:
+            continue
+        if low is None or k < low:
+            low = k
+        if high is None or k > high:
+            high = k
+    return None if low is None else (low, high)
+
+
+def merged_bounds(bounds: Iterable[Bounds]) -> Bounds:
+    """Returns the bounds covering all the given bounds."""
+    low = high = None
+    for b in bounds:
+        if b is None:
+            continue
+        if low is None or b[0] < low:
+            low = b[0]
+        if high is None or b[1] > high:
+            high = b[1]
+    return None if low is None else (low, high)
+
+
+class _Infinity:
+    def __init__(self, sign: int):
+        self._sign = sign
+
+    def __lt__(self, other):
+        return self._sign < 0
+
+    def __gt__(self, other):
+        return self._sign > 0
+
+
+_PLUS_INFINITY = _Infinity(1)
+_MINUS_INFINITY = _Infinity(-1)
+
+
+def _parse_bounds(line: str) -> Tuple[int, Bounds]:
+    num, low, high = json.loads(line)
+    return num, None if low is None else (low, high)
+
+
+class KeyBounds:
+    """The minimum and the maximum keys of the lines in the compressed files
+    of a directory.
+
+    The bounds are kept in an append-only file with a JSON `[number, min,
+    max]` list on each line, so only the JSON numbers and strings are
+    saved. The bounds are added when a file is compressed. The missing
+    bounds are just computed again.
+    """
+
+    def __init__(self, file: Path):
+        self._file = file
+        self._lock = threading.Lock()
+        self._bounds: Optional[Dict[int, Bounds]] = None
+        # (first_num, prefix maximums, suffix minimums) for consecutive
+        # numbers, built on demand
+        self._run: Optional[Tuple[int, List[Any], List[Any]]] = None
+
+    def _load(self) -> Dict[int, Bounds]:
+        if self._bounds is None:
+            self._bounds = dict(load_entries(self._file, _parse_bounds))
+        return self._bounds
+
+    def get(self, num: int) -> Tuple[bool, Bounds]:
+        """Returns whether the bounds are known, and the bounds."""
+        with self._lock:
+            bounds = self._load()
+            return num in bounds, bounds.get(num)
+
+    def add(self, num: int, bounds: Bounds):
+        """Adds the bounds of the file. The bounds that do not survive the
+        conversion to JSON, like dates or tuples, are kept only in memory:
+        other processes compute them again."""
+        with self._lock:
+            known = self._load()
+            if num in known and known[num] == bounds:
+                return
+            low, high = bounds if bounds is not None else (None, None)
+            try:
+                entry = json.dumps([num, low, high])
+            except (TypeError, ValueError):
+                entry = None
+            if entry is not None and _parse_bounds(entry) == (num, bounds):
+                append_entry(self._file, entry)
+            known[num] = bounds
+            self._run = None
+
+    def _build_run(self, first_num: int) -> Tuple[int, List[Any], List[Any]]:
+        known = self._load()
+        nums: List[int] = []
+        num = first_num
+        while num in known:
+            nums.append(num)
+            num += 1
+        prefix_max: List[Any] = []
+        current: Any = _MINUS_INFINITY
+        for n in nums:
+            b = known[n]
+            if b is not None and (current is _MINUS_INFINITY
+                                  or b[1] > current):
+                current = b[1]
+            prefix_max.append(current)
+        suffix_min: List[Any] = []
+        current = _PLUS_INFINITY
+        for n in reversed(nums):
+            b = known[n]
+            if b is not None and (current is _PLUS_INFINITY
+                                  or b[0] < current):
+                current = b[0]
+            suffix_min.append(current)
+        suffix_min.reverse()
+        return first_num, prefix_max, suffix_min
+
+    def skippable(self, first_num: int, low: Any, high: Any) \
+            -> Tuple[int, int, int]:
+        """Finds the files that cannot contain keys in `[low, high)`,
+        among the consecutive known numbers from `first_num`.
+
+        Returns the number of the first file to read, and the numbers
+        `[skip_from, skip_to)` of the files that can be skipped after it.
+        """
+        with self._lock:
+            if self._run is None or self._run[0] != first_num:
+                self._run = self._build_run(first_num)
+            _, prefix_max, suffix_min = self._run
+        # all the files before have the maximum below `low`
+        start = bisect.bisect_left(prefix_max, low)
+        # all the files from here have the minimum at or above `high`
+        skip_from = max(bisect.bisect_left(suffix_min, high), start)
+        return first_num + start, first_num + skip_from, \
+            first_num + len(prefix_max)
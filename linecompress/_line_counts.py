@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import bisect
+import itertools
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from linecompress._append_log import append_entry, load_entries
+
+
+def _parse_count(line: str) -> Tuple[int, int]:
+    num, count = (int(s) for s in line.split())
+    return num, count
+
+
+class LineCounts:
+    """Numbers of lines in the compressed files of a directory.
+
+    The counts are kept in an append-only text file with a `number count`
+    pair on each line. A count is added when a file is compressed, so the
+    file never has to be rewritten. A count that is missing (for example,
+    the file was compressed by an older version) is just counted again.
+
+    The text sizes of the compressed files are kept the same way.
+    """
+
+    def __init__(self, file: Path):
+        self._file = file
+        self._lock = threading.Lock()
+        self._counts: Optional[Dict[int, int]] = None
+        # cumulative counts for consecutive numbers, built on demand
+        self._run: Optional[Tuple[int, List[int], List[int]]] = None
+
+    def _load(self) -> Dict[int, int]:
+        if self._counts is None:
+            self._counts = dict(load_entries(self._file, _parse_count))
+        return self._counts
+
+    def get(self, num: int) -> Optional[int]:
+        with self._lock:
+            return self._load().get(num)
+
+    def add(self, num: int, count: int):
+        with self._lock:
+            counts = self._load()
+            if counts.get(num) == count:
+                return
+            append_entry(self._file, f'{num} {count}')
+            counts[num] = count
+            self._run = None
+
+    def find(self, first_num: int, line: int) -> Tuple[int, int]:
+        """Finds the file containing the `line`, counting the lines from the
+        start of the file `first_num`. Returns the number of the file and the
+        number of the line within that file.
+
+        Only the consecutive numbers known from `first_num` are searched. If
+        the line is after them, the result is the number following the last
+        known one, and the line number relative to it.
+        """
+        with self._lock:
+            counts = self._load()
+            if self._run is None or self._run[0] != first_num:
+                nums = list(itertools.takewhile(
+                    lambda n: n in counts, itertools.count(first_num)))
+                ends = list(itertools.accumulate(counts[n] for n in nums))
+                self._run = (first_num, nums, ends)
+            _, nums, ends = self._run
+        i = bisect.bisect_right(ends, line)
+        if i < len(nums):
+            return nums[i], line - (ends[i - 1] if i > 0 else 0)
+        return first_num + len(nums), line - (ends[-1] if ends else 0)
@@ -0,0 +1,102 @@
+"""Locks between processes.
+
+On POSIX the locks are `flock` locks, that are released when the file is
+closed, even if the process is killed. On Windows there are no shared
+locks, so a shared lock is exclusive.
+"""
+
+from __future__ import annotations
+
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+
+try:
+    import msvcrt  # pylint: disable=import-error
+except ImportError:  # POSIX
+    msvcrt = None  # type: ignore
+
+
+def lock_fd(fd: int, shared: bool = False, blocking: bool = True) -> bool:
+    """Locks the open file. Returns False if the lock is not blocking and
+    the file is already locked."""
+    if fcntl is not None:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, flags)
+        except BlockingIOError:
+            return False
+        return True
+    os.lseek(fd, 0, os.SEEK_SET)
+    while True:
+        try:
+            msvcrt.locking(fd,  # type: ignore
+                           msvcrt.LK_LOCK if blocking  # type: ignore
+                           else msvcrt.LK_NBLCK, 1)  # type: ignore
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            # LK_LOCK gives up after 10 seconds
+
+
+# Windows does not allow renaming or removing an open file
+CAN_RENAME_LOCKED = fcntl is not None
+
+
+def remove_if_unlocked(file: Path) -> bool:
+    """Removes the file unless it is locked by someone else. Returns True
+    if the file was removed."""
+    try:
+        fd = os.open(file, os.O_RDWR)
+    except FileNotFoundError:
+        return False
+    try:
+        if not lock_fd(fd, blocking=False):
+            return False
+        if CAN_RENAME_LOCKED:
+            os.remove(file)
+            return True
+    finally:
+        os.close(fd)
+    try:
+        os.remove(file)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+class DirLock:
+    """A lock for the processes writing to the same directory. It is held
+    on a lock file in the directory.
+
+    The lock file is opened for each acquisition, so the lock also works
+    between the threads of one process."""
+
+    def __init__(self, file: Path):
+        self._file = file
+
+    @contextmanager
+    def _locked(self, shared: bool) -> Iterator[None]:
+        self._file.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self._file, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            lock_fd(fd, shared=shared)
+            yield
+        finally:
+            # closing the file releases the lock
+            os.close(fd)
+
+    def shared(self):
+        return self._locked(shared=True)
+
+    def exclusive(self):
+        return self._locked(shared=False)
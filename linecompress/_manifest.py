@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+_MANIFEST_FORMAT_VERSION = 1
+
+
+class Manifest:
+    """The numbers of the first and the last files of a directory.
+
+    The files are numbered consecutively, so knowing the range is enough to
+    list them without reading the directories. The manifest is small and
+    does not grow with the number of files, so it is cheap to rewrite on
+    each rollover. It is replaced by renaming, so a reader never sees it
+    half-written.
+
+    The manifest is only a hint: the directory itself remains the source of
+    truth, and the manifest is rebuilt from it when it turns out to be
+    stale.
+    """
+
+    def __init__(self, file: Path):
+        self._file = file
+
+    def load(self) -> Optional[Tuple[int, int]]:
+        try:
+            data = json.loads(self._file.read_text())
+            if data['version'] != _MANIFEST_FORMAT_VERSION:
+                return None
+            return int(data['first']), int(data['last'])
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, first: int, last: int):
+        self._file.parent.mkdir(parents=True, exist_ok=True)
+        # the name is unique, since other processes may save at the same time
+        temp = self._file.parent / (f'{self._file.name}.{os.getpid()}.'
+                                    f'{threading.get_ident()}.tmp')
+        temp.write_text(json.dumps({'version': _MANIFEST_FORMAT_VERSION,
+                                    'first': first,
+                                    'last': last}))
+        os.replace(temp, self._file)
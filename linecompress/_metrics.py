@@ -0,0 +1,127 @@
+"""Measurements of what a `LinesDir` is doing.
+
+The counters:
+- 'lines_in', 'bytes_in': the lines appended and their encoded size
+- 'bytes_out': the size of the files produced by the compression
+- 'segment_open': the files opened for reading the lines
+- 'walk': the walks over the directory tree
+
+The timings, in seconds:
+- 'append': a `LinesDir.append` call, including the rollover it causes
+- 'rollover': closing the full file and starting the next one, including
+  the compression unless it runs in background
+- 'compress': the compression of a file
+- 'dir_listing': listing one directory of the tree
+
+Without an observer, the measurements are not even taken.
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# from one microsecond to about two minutes, each bound twice the previous
+_BUCKET_BOUNDS = [1e-6 * 2 ** i for i in range(28)]
+
+
+class Observer:
+    """Receives the measurements of a `LinesDir`. The methods do nothing:
+    a subclass overrides the ones it needs. The methods may be called from
+    several threads."""
+
+    def count(self, name: str, value: int = 1) -> None:
+        pass
+
+    def timing(self, name: str, seconds: float) -> None:
+        pass
+
+
+@contextmanager
+def timed(observer: Optional[Observer], name: str) -> Iterator[None]:
+    if observer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observer.timing(name, time.perf_counter() - started)
+
+
+class _Histogram:
+    def __init__(self):
+        # the last bucket is for the values above all the bounds
+        self.buckets: List[int] = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.buckets[bisect.bisect_left(_BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction: float) -> float:
+        """Returns the upper bound of the bucket with the percentile."""
+        rank = fraction * self.count
+        seen = 0
+        for i, in_bucket in enumerate(self.buckets):
+            seen += in_bucket
+            if seen >= rank and in_bucket:
+                return _BUCKET_BOUNDS[i] if i < len(_BUCKET_BOUNDS) \
+                    else self.max
+        return self.max
+
+    def export(self) -> Dict[str, Any]:
+        return {'count': self.count,
+                'sum': self.sum,
+                'min': self.min if self.count else 0.0,
+                'max': self.max,
+                'p50': self.percentile(0.5),
+                'p99': self.percentile(0.99),
+                'buckets': {f'{bound:g}': n for bound, n
+                            in zip(_BUCKET_BOUNDS, self.buckets) if n},
+                'above': self.buckets[-1]}
+
+
+class MetricsCollector(Observer):
+    """Keeps the counters, and the histograms of the timings, in memory.
+
+    The histogram buckets are bounded by the powers of two from one
+    microsecond, so the percentiles are accurate within a factor of two.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._timings: Dict[str, _Histogram] = {}
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def timing(self, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._timings.get(name)
+            if histogram is None:
+                histogram = self._timings[name] = _Histogram()
+            histogram.add(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the measurements as a dict that can be saved as JSON."""
+        with self._lock:
+            return {'counters': dict(self._counters),
+                    'timings': {name: h.export()
+                                for name, h in self._timings.items()}}
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._timings = {}
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future, wait, \
+    as_completed, FIRST_COMPLETED
+from pathlib import Path
+from typing import Callable, Iterable, Optional, TypeVar, Deque, Set, Any
+
+from linecompress._file import LinesFile
+
+T = TypeVar('T')
+
+
+def _apply_to_file(func: Callable[[Iterable[Any]], T], binary: bool,
+                   file: Path) -> T:
+    # another process may be compressing the file, so no cleanup
+    lf = LinesFile(file, cleanup=False)
+    return func(lf.iter_byte_lines() if binary else lf.iter_str_lines())
+
+
+def parallel_map(func: Callable[[Iterable[Any]], T],
+                 files: Iterable[Path],
+                 binary: bool = False,
+                 workers: Optional[int] = None,
+                 ordered: bool = True) -> Iterable[T]:
+    """Calls `func` for the lines of each file in a pool of processes and
+    yields the results.
+
+    No more than two files per worker are queued at a time, so the results
+    do not pile up in memory when they are consumed slower than produced.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(workers)
+    max_queued = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        def submit(file: Path) -> Future:
+            return executor.submit(_apply_to_file, func, binary, file)
+
+        if ordered:
+            queue: Deque[Future] = deque()
+            for file in files:
+                queue.append(submit(file))
+                if len(queue) >= max_queued:
+                    yield queue.popleft().result()
+            while queue:
+                yield queue.popleft().result()
+        else:
+            running: Set[Future] = set()
+            for file in files:
+                running.add(submit(file))
+                if len(running) >= max_queued:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in as_completed(running):
+                yield future.result()
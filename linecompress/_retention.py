@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Any, Deque, Optional, Tuple
+
+
+class Retention:
+    """The limits for keeping the old files of a directory.
+
+    A file is removed if the directory is above `max_bytes` or `max_files`
+    with it, if it was last modified more than `max_age` seconds ago, or if
+    all its keys are below `min_key`. Only the compressed files are
+    removed, from the oldest, and the last file is always kept.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None,
+                 max_files: Optional[int] = None,
+                 max_age: Optional[float] = None,
+                 min_key: Any = None):
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError(max_bytes)
+        if max_files is not None and max_files < 1:
+            raise ValueError(max_files)
+        if max_age is not None and max_age < 0:
+            raise ValueError(max_age)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_age = max_age
+        self.min_key = min_key
+
+
+class OldestSizes:
+    """The numbers and the sizes of the compressed files from the oldest,
+    up to the first raw file.
+
+    The files are listed once, and then only the new ones are added. So
+    the total size is known without listing the whole tree each time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._sizes: Deque[Tuple[int, int]] = deque()
+        self._next_num: Optional[int] = None
+        self.total = 0
+
+    @property
+    def next_num(self) -> Optional[int]:
+        """The number from which the files are not listed yet."""
+        return self._next_num
+
+    def add(self, num: int, size: int):
+        self._sizes.append((num, size))
+        self.total += size
+        self._next_num = num + 1
+
+    def oldest_num(self) -> Optional[int]:
+        return self._sizes[0][0] if self._sizes else None
+
+    def pop_oldest(self):
+        _, size = self._sizes.popleft()
+        self.total -= size
+
+    def __len__(self) -> int:
+        return len(self._sizes)
@@ -0,0 +1,144 @@
+"""Reading lines from the end of a file without holding the whole file in
+memory.
+
+A raw file is read backwards in blocks, seeking from the end.
+
+Other formats are decompressed to a temporary file, that is then read
+backwards like a raw one.
+
+A gzip stream cannot be decompressed backwards. So it is decompressed once
+from the start, and every `span` bytes of output the state of the
+decompressor is saved as a checkpoint. Then the spans are decompressed again
+from the last checkpoint to the first. Only one span of decompressed data is
+in memory at a time.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import zlib
+from typing import BinaryIO, Iterable, List, NamedTuple, Optional, Any
+
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+_BACKWARD_CHUNK_SIZE = 1 << 16
+_GZIP_INPUT_CHUNK_SIZE = 1 << 16
+_GZIP_CHECKPOINT_SPAN = 1 << 20
+
+
+def _reversed_lines(blocks_from_end: Iterable[bytes]) -> Iterable[bytes]:
+    """Takes the blocks of a stream from the last to the first and yields
+    the lines from the last to the first.
+
+    The lines are the same as when reading forward: a single newline at the
+    end of the stream does not make an empty line."""
+    carry = b''
+    is_last_block = True
+    for block in blocks_from_end:
+        if not block:
+            continue
+        if is_last_block:
+            is_last_block = False
+            if block.endswith(b'\n'):
+                block = block[:-1]
+        parts = (block + carry).split(b'\n')
+        carry = parts[0]
+        for i in range(len(parts) - 1, 0, -1):
+            yield parts[i]
+    if not is_last_block:
+        yield carry
+
+
+def _raw_blocks_from_end(f: BinaryIO,
+                         chunk_size: int = _BACKWARD_CHUNK_SIZE) \
+        -> Iterable[bytes]:
+    pos = f.seek(0, os.SEEK_END)
+    while pos > 0:
+        step = min(chunk_size, pos)
+        pos -= step
+        f.seek(pos)
+        yield f.read(step)
+
+
+def _spooled_blocks_from_end(stream: BinaryIO,
+                             chunk_size: int = _BACKWARD_CHUNK_SIZE) \
+        -> Iterable[bytes]:
+    with tempfile.TemporaryFile() as temp:
+        shutil.copyfileobj(stream, temp, chunk_size)
+        yield from _raw_blocks_from_end(temp, chunk_size)  # type: ignore
+
+
+class _Checkpoint(NamedTuple):
+    in_offset: int
+    out_offset: int
+    # None means the start of a gzip member
+    decompressor: Optional[Any]
+
+    def restore(self):
+        if self.decompressor is None:
+            return zlib.decompressobj(wbits=_GZIP_WBITS)
+        return self.decompressor.copy()
+
+
+def _gzip_checkpoints(f: BinaryIO, span: int) -> List[_Checkpoint]:
+    """Decompresses the whole stream, saving the state each `span` bytes of
+    the output. The last item only marks the end of the output."""
+    checkpoints = [_Checkpoint(0, 0, None)]
+    d = zlib.decompressobj(wbits=_GZIP_WBITS)
+    in_offset = 0
+    out_offset = 0
+    member_start = 0
+    since_checkpoint = 0
+    pending = b''
+    while True:
+        if not pending:
+            pending = f.read(_GZIP_INPUT_CHUNK_SIZE)
+            if not pending:
+                break
+        out = d.decompress(pending, span - since_checkpoint)
+        out_offset += len(out)
+        since_checkpoint += len(out)
+        if d.eof:
+            # the member is over; the rest may be another member
+            in_offset += len(pending) - len(d.unused_data)
+            pending = d.unused_data
+            member_start = in_offset
+            d = zlib.decompressobj(wbits=_GZIP_WBITS)
+            checkpoints.append(_Checkpoint(in_offset, out_offset, None))
+            since_checkpoint = 0
+            continue
+        in_offset += len(pending) - len(d.unconsumed_tail)
+        pending = d.unconsumed_tail
+        if since_checkpoint >= span:
+            checkpoints.append(_Checkpoint(in_offset, out_offset, d.copy()))
+            since_checkpoint = 0
+    if in_offset > member_start:
+        raise EOFError("Compressed file ended before the end-of-stream "
+                       "marker was reached")
+    return checkpoints
+
+
+def _gzip_blocks_from_end(f: BinaryIO, span: int = _GZIP_CHECKPOINT_SPAN) \
+        -> Iterable[bytes]:
+    checkpoints = _gzip_checkpoints(f, span)
+    for start, end in reversed(list(zip(checkpoints, checkpoints[1:]))):
+        size = end.out_offset - start.out_offset
+        if size == 0:
+            continue
+        f.seek(start.in_offset)
+        d = start.restore()
+        parts: List[bytes] = []
+        received = 0
+        data = b''
+        while received < size:
+            if not data:
+                data = f.read(_GZIP_INPUT_CHUNK_SIZE)
+                if not data:
+                    raise EOFError("Compressed file ended unexpectedly")
+            out = d.decompress(data, size - received)
+            data = d.unconsumed_tail
+            parts.append(out)
+            received += len(out)
+        yield b''.join(parts)
@@ -0,0 +1,93 @@
+"""Bloom filters over the tokens of the compressed files.
+
+A token is a run of letters, digits and underscores (any non-ASCII bytes
+are treated as letters, so the words in UTF-8 are tokens too). The filter
+tells for sure that a token is not in the file, so the file can be skipped
+by a search without decompressing it. With the default false positive rate
+one of a hundred files without the token is still searched.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import re
+import struct
+from pathlib import Path
+from typing import Iterable, Optional, Set, Tuple
+
+_TOKEN_RE = re.compile(rb'[0-9A-Za-z_\x80-\xff]+')
+
+_HEADER = struct.Struct('<4sII')
+_MAGIC = b'LCB1'
+
+
+def tokens_of(data: bytes) -> Set[bytes]:
+    return set(_TOKEN_RE.findall(data))
+
+
+def _hash_pair(token: bytes) -> Tuple[int, int]:
+    digest = hashlib.blake2b(token, digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), \
+        int.from_bytes(digest[8:], 'little') | 1
+
+
+class TokenSketch:
+    def __init__(self, bits: bytearray, hashes: int):
+        self._bits = bits
+        self._size = len(bits) * 8
+        self._hashes = hashes
+
+    def _positions(self, token: bytes) -> Iterable[int]:
+        h1, h2 = _hash_pair(token)
+        for i in range(self._hashes):
+            yield (h1 + i * h2) % self._size
+
+    @staticmethod
+    def build(blocks: Iterable[bytes],
+              false_positive_rate: float = 0.01) -> TokenSketch:
+        tokens: Set[bytes] = set()
+        for block in blocks:
+            tokens.update(_TOKEN_RE.findall(block))
+        return TokenSketch.of_tokens(tokens, false_positive_rate)
+
+    @staticmethod
+    def of_tokens(tokens: Set[bytes],
+                  false_positive_rate: float = 0.01) -> TokenSketch:
+        count = max(len(tokens), 1)
+        size = math.ceil(-count * math.log(false_positive_rate)
+                         / math.log(2) ** 2)
+        hashes = max(1, round(size / count * math.log(2)))
+        sketch = TokenSketch(bytearray((size + 7) // 8), hashes)
+        bits = sketch._bits
+        for token in tokens:
+            for pos in sketch._positions(token):
+                bits[pos >> 3] |= 1 << (pos & 7)
+        return sketch
+
+    def may_contain(self, token: bytes) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(token))
+
+    def save(self, file: Path):
+        temp = file.parent / (file.name + '.tmp')
+        temp.write_bytes(_HEADER.pack(_MAGIC, self._size, self._hashes)
+                         + bytes(self._bits))
+        os.replace(temp, file)
+
+    @staticmethod
+    def load(file: Path) -> Optional[TokenSketch]:
+        """Returns None if the sketch does not exist or cannot be used."""
+        try:
+            data = file.read_bytes()
+        except FileNotFoundError:
+            return None
+        if len(data) < _HEADER.size:
+            return None
+        magic, size, hashes = _HEADER.unpack_from(data)
+        bits = bytearray(data[_HEADER.size:])
+        if magic != _MAGIC or size != len(bits) * 8 or hashes < 1:
+            return None
+        return TokenSketch(bits, hashes)
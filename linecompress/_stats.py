@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from typing import NamedTuple
+
+
+class DirStats(NamedTuple):
+    """The totals of a `LinesDir`.
+
+    `disk_bytes` is the size of the files as they are on the disk, and
+    `text_bytes` is the size of the text in them, as it would be
+    decompressed.
+    """
+    files: int
+    compressed_files: int
+    lines: int
+    disk_bytes: int
+    text_bytes: int
+
+    @property
+    def ratio(self) -> float:
+        """The text size divided by the size on the disk."""
+        return self.text_bytes / self.disk_bytes if self.disk_bytes else 1.0
@@ -0,0 +1,87 @@
+"""Waiting for changes in directories.
+
+On Linux the waiting is woken by inotify as soon as something in the
+watched directories changes. Elsewhere it just sleeps. Either way it ends
+after the timeout, so the callers poll anyway, and inotify only makes them
+notice the changes sooner.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+_IN_MODIFY = 0x002
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+
+def _load_libc() -> Optional[Any]:
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _ = libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class ChangeWaiter:
+    def __init__(self):
+        self._libc = _load_libc()
+        self._fd = -1
+        if self._libc is not None:
+            self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        self._watches: Dict[Path, int] = {}
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd >= 0
+
+    def watch(self, dirs: Iterable[Path]):
+        """Sets the directories to watch, replacing the previous ones."""
+        if self._fd < 0:
+            return
+        dirs = set(dirs)
+        for old in set(self._watches) - dirs:
+            self._libc.inotify_rm_watch(self._fd, self._watches.pop(old))
+        for new in dirs - set(self._watches):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(new),
+                                              _WATCH_MASK)
+            if wd >= 0:  # the directory may not exist yet
+                self._watches[new] = wd
+
+    def wait(self, timeout: float):
+        """Waits for a change in the watched directories, but no longer
+        than `timeout` seconds."""
+        if self._fd < 0:
+            time.sleep(timeout)
+            return
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self._fd, 1 << 16):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+            self._watches = {}
+
+    def __enter__(self) -> ChangeWaiter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
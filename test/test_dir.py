@@ -1,11 +1,28 @@
+import asyncio
+import datetime
+import json
+import os
 import random
+import threading
+import time
 import unittest
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import Optional, List
+from unittest import mock
 
 from linecompress._dir import NumberedFilePath, _split_nums, _combine_nums, \
-    LinesDir
+    LinesDir, LinesDirWriter
+from linecompress._async import AsyncLinesDir
+from linecompress._catalog import SegmentCatalog, iter_segments
+from linecompress._codecs import GzipCodec, LzmaCodec, Bz2Codec
+from linecompress._cursor import Cursor
+from linecompress._durability import fsync_dir
+from linecompress._file import LinesFile
+from linecompress._metrics import MetricsCollector, Observer
+from linecompress._retention import Retention
+from linecompress._stats import DirStats
 from linecompress._search_last import _num_prefix, _strings_sorted_by_num_prefix
 
 
@@ -300,3 +317,1094 @@ class TestHolmes(unittest.TestCase):
             lines_read += 1
             self.assertEqual(a, b)
         self.assertEqual(lines_read, 1130)
+
+
+class TestAppendMany(unittest.TestCase):
+    def test_same_as_append(self):
+        source = Path(__file__).parent / "data" / "dancing.txt"
+        lines = source.read_text().splitlines()
+        with TemporaryDirectory() as one, TemporaryDirectory() as many:
+            by_one = LinesDir(path=Path(one), buffer_size=1024)
+            for line in lines:
+                by_one.append(line)
+            by_many = LinesDir(path=Path(many), buffer_size=1024)
+            by_many.append_many(lines)
+
+            self.assertEqual(list(by_many), lines)
+            self.assertEqual(
+                sorted(str(p.relative_to(one))
+                       for p in Path(one).rglob('*') if p.is_file()),
+                sorted(str(p.relative_to(many))
+                       for p in Path(many).rglob('*') if p.is_file()))
+
+    def test_continues_existing(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=150)
+            ld.append('first')
+            ld.append_many(_rnd(50) for _ in range(5))
+            ld.append('last')
+            lines = list(ld)
+            self.assertEqual(len(lines), 7)
+            self.assertEqual(lines[0], 'first')
+            self.assertEqual(lines[-1], 'last')
+
+    def test_newline_rejected(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds))
+            with self.assertRaises(ValueError):
+                ld.append_many(['good', 'bad\nline'])
+            self.assertEqual(list(ld), ['good'])
+
+
+class TestWriter(unittest.TestCase):
+    def test_rollover(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=150)
+            lines = [_rnd(50) for _ in range(10)]
+            with ld.writer() as writer:
+                for line in lines:
+                    writer.append(line)
+                self.assertEqual(writer.current_file,
+                                 Path(tds) / '000/000/003.txt')
+            self.assertEqual(list(ld), lines)
+            self.assertTrue((Path(tds) / '000/000/002.txt.gz').exists())
+            self.assertEqual(ld._file_for_appending(),
+                             Path(tds) / '000/000/003.txt')
+
+    def test_tree_is_searched_once(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=150)
+            ld.append('existing')
+            with mock.patch.object(LinesDir, '_numerically_last_file',
+                                   wraps=ld._numerically_last_file) as m:
+                with ld.writer() as writer:
+                    for _ in range(20):
+                        writer.append(_rnd(50))
+                self.assertEqual(m.call_count, 1)
+            self.assertEqual(len(list(ld)), 21)
+
+    def test_flush(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds))
+            writer = LinesDirWriter(ld)
+            writer.append('one')
+            writer.flush()
+            self.assertEqual(list(ld), ['one'])
+            writer.append('two')
+            writer.close()
+            self.assertEqual(list(ld), ['one', 'two'])
+
+
+class TestGroupWriter(unittest.TestCase):
+    def test_threads(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=3000)
+            with mock.patch.object(LinesDirWriter, '_write_batch',
+                                   autospec=True,
+                                   side_effect=LinesDirWriter._write_batch) \
+                    as m:
+                with ld.group_writer(max_latency=0.01, max_batch=50,
+                                     max_queued=100) as writer:
+                    def produce(thread: int):
+                        for i in range(200):
+                            writer.append(f'thread {thread} line {i}')
+
+                    threads = [threading.Thread(target=produce, args=(t,))
+                               for t in range(8)]
+                    for t in threads:
+                        t.start()
+                    for t in threads:
+                        t.join()
+                self.assertLess(m.call_count, 8 * 200)
+            lines = list(ld)
+            self.assertEqual(len(lines), 8 * 200)
+            for thread in range(8):
+                self.assertEqual(
+                    [line for line in lines
+                     if line.startswith(f'thread {thread} ')],
+                    [f'thread {thread} line {i}' for i in range(200)])
+            self.assertGreater(
+                sum(1 for _ in Path(tds).rglob('[0-9]*.txt.gz')), 3)
+
+    def test_flush(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds))
+            with ld.group_writer(max_latency=60) as writer:
+                writer.append('one')
+                writer.flush()
+                self.assertEqual(list(ld), ['one'])
+                writer.append('two')
+            self.assertEqual(list(ld), ['one', 'two'])
+            with self.assertRaises(ValueError):
+                writer.append('three')
+
+    def test_error_is_raised(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds))
+            writer = ld.group_writer()
+            with mock.patch.object(LinesDirWriter, '_write_batch',
+                                   side_effect=OSError('disk full')):
+                writer.append('one')
+                with self.assertRaises(OSError):
+                    writer.flush()
+                with self.assertRaises(OSError):
+                    writer.append('two')
+                with self.assertRaises(OSError):
+                    writer.close()
+
+
+class TestBackgroundCompression(unittest.TestCase):
+    def test_compressed_in_background(self):
+        source = Path(__file__).parent / "data" / "dancing.txt"
+        lines = source.read_text().splitlines()
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=1024,
+                          background_compression=True,
+                          max_pending_compressions=2)
+            for line in lines[:500]:
+                ld.append(line)
+            with ld.writer() as writer:
+                writer.append_many(lines[500:])
+            ld.wait_compressed()
+
+            files = sorted(p.name for p in Path(tds).rglob('[0-9]*')
+                           if p.is_file())
+            self.assertTrue(all(f.endswith('.txt.gz') for f in files[:-1]))
+            self.assertTrue(files[-1].endswith('.txt'))
+            self.assertEqual(list(ld), lines)
+            self.assertEqual(list(reversed(ld)), list(reversed(lines)))
+
+    def test_max_pending(self):
+        with self.assertRaises(ValueError):
+            LinesDir(Path('.'), background_compression=True,
+                     max_pending_compressions=0)
+
+
+class TestUnfinishedCompression(unittest.TestCase):
+    def test_each_number_read_once(self):
+        with TemporaryDirectory() as tds:
+            root = Path(tds)
+            ld = LinesDir(path=root, buffer_size=15)
+            ld.append_many(['line one', 'line two', 'line three'])
+            # looks like compression of 000 was interrupted after the
+            # renaming, and compression of 001 is in progress
+            (root / '000/000/000.txt').write_text('line one\nline two\n')
+            (root / '000/000/001.txt.gz.tmp').write_bytes(b'partial')
+
+            self.assertEqual(
+                [p.name for p in ld._recurse_files(reverse=False)],
+                ['000.txt.gz', '001.txt'])
+            self.assertEqual(list(LinesDir(root, background_compression=True)),
+                             ['line one', 'line two', 'line three'])
+
+
+class TestIndexedFiles(unittest.TestCase):
+    def test_index_files_ignored(self):
+        with TemporaryDirectory() as tds:
+            for background in [False, True]:
+                root = Path(tds) / str(background)
+                ld = LinesDir(path=root, buffer_size=500, index_span=100,
+                              background_compression=background)
+                lines = [_rnd(30) for _ in range(100)]
+                ld.append_many(lines)
+                ld.wait_compressed()
+                self.assertTrue((root / '000/000/000.txt.gz.idx').exists())
+                self.assertTrue(all(
+                    not p.name.endswith('.idx')
+                    for p in ld._recurse_files(reverse=True)))
+                self.assertEqual(list(ld), lines)
+                self.assertEqual(list(reversed(ld)), list(reversed(lines)))
+
+
+class TestStartLine(unittest.TestCase):
+    def test_start(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=200, subdirs=1)
+            lines = [_rnd(random.randint(0, 60)) for _ in range(300)]
+            ld.append_many(lines)
+            for start in [0, 1, 7, 150, 298, 299, 300, 1000]:
+                with self.subTest(start):
+                    self.assertEqual(list(ld.iter_str_lines(start=start)),
+                                     lines[start:])
+            self.assertEqual(ld[0], lines[0])
+            self.assertEqual(ld[123], lines[123])
+            self.assertEqual(ld[-1], lines[-1])
+            self.assertEqual(ld[-300], lines[0])
+            with self.assertRaises(IndexError):
+                _ = ld[300]
+            with self.assertRaises(IndexError):
+                _ = ld[-301]
+
+    def test_compressed_files_not_read(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=200)
+            lines = [_rnd(50) for _ in range(100)]
+            ld.append_many(lines)
+            with mock.patch.object(LinesFile, 'count_lines', autospec=True,
+                                   side_effect=LinesFile.count_lines) as m:
+                self.assertEqual(ld[97], lines[97])
+                # only the raw last file is counted
+                self.assertEqual(m.call_count, 1)
+
+    def test_counts_rebuilt(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=200)
+            lines = [_rnd(50) for _ in range(100)]
+            ld.append_many(lines)
+            (Path(tds) / 'line_counts.txt').write_text('0 4\n12 ')
+            ld = LinesDir(path=Path(tds), buffer_size=200)
+            self.assertEqual(list(ld.iter_str_lines(start=95)), lines[95:])
+            ld = LinesDir(path=Path(tds), buffer_size=200)
+            with mock.patch.object(LinesFile, 'count_lines', autospec=True,
+                                   side_effect=LinesFile.count_lines) as m:
+                self.assertEqual(ld[90], lines[90])
+                self.assertEqual(m.call_count, 1)
+
+
+class TestManifest(unittest.TestCase):
+    def test_directories_not_read(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=200, manifest=True)
+            ld.append('first')
+            with mock.patch('linecompress._dir.iter_segments') as m:
+                lines = ['first'] + [_rnd(50) for _ in range(100)]
+                for line in lines[1:50]:
+                    ld.append(line)
+                ld.append_many(lines[50:])
+                self.assertEqual(list(ld), lines)
+                self.assertEqual(list(reversed(ld)), list(reversed(lines)))
+                self.assertEqual(list(ld.iter_str_lines(start=70)),
+                                 lines[70:])
+                self.assertEqual(m.call_count, 0)
+            self.assertEqual(json.loads((Path(tds) / 'manifest.json')
+                                        .read_text())['last'], 24)
+
+    def test_rebuilt(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=200, manifest=True)
+            lines = [_rnd(50) for _ in range(40)]
+            ld.append_many(lines[:20])
+
+            with self.subTest("Missing"):
+                (Path(tds) / 'manifest.json').unlink()
+                self.assertEqual(
+                    list(LinesDir(path=Path(tds), manifest=True)),
+                    lines[:20])
+                self.assertTrue((Path(tds) / 'manifest.json').exists())
+
+            with self.subTest("Stale"):
+                LinesDir(path=Path(tds), buffer_size=200) \
+                    .append_many(lines[20:])
+                self.assertEqual(list(ld), lines)
+                self.assertEqual(
+                    list(LinesDir(path=Path(tds), manifest=True)), lines)
+
+
+class TestMixedCodecs(unittest.TestCase):
+    def test_mixed(self):
+        with TemporaryDirectory() as tds:
+            lines = [_rnd(50) for _ in range(60)]
+            for i, codec in enumerate([GzipCodec(), LzmaCodec(level=1),
+                                       Bz2Codec()]):
+                for j, manifest in enumerate([False, True]):
+                    ld = LinesDir(path=Path(tds), buffer_size=200,
+                                  codec=codec, manifest=manifest)
+                    start = i * 20 + j * 10
+                    ld.append_many(lines[start:start + 10])
+            suffixes = {p.name.split('.', 1)[1]
+                        for p in Path(tds).rglob('[0-9]*') if p.is_file()}
+            self.assertEqual(suffixes, {'txt', 'txt.gz', 'txt.xz', 'txt.bz2'})
+            for manifest in [False, True]:
+                ld = LinesDir(path=Path(tds), manifest=manifest)
+                self.assertEqual(list(ld), lines)
+                self.assertEqual(list(reversed(ld)), list(reversed(lines)))
+                self.assertEqual(ld[45], lines[45])
+
+
+def _count_lines(lines) -> int:
+    return sum(1 for _ in lines)
+
+
+class TestParallel(unittest.TestCase):
+    def test_parallel(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=500)
+            lines = [_rnd(random.randint(0, 60)) for _ in range(500)]
+            ld.append_many(lines)
+
+            self.assertEqual(list(ld.parallel_iter(workers=3)), lines)
+            self.assertEqual(
+                list(ld.parallel_iter(workers=2, binary=True)),
+                [line.encode() for line in lines])
+            self.assertEqual(
+                sorted(ld.parallel_iter(workers=3, ordered=False)),
+                sorted(lines))
+
+            counts = list(ld.parallel_map(_count_lines, workers=2))
+            self.assertGreater(len(counts), 10)
+            self.assertEqual(sum(counts), len(lines))
+            self.assertEqual(
+                sum(ld.parallel_map(_count_lines, ordered=False)),
+                len(lines))
+
+    def test_empty(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds))
+            self.assertEqual(list(ld.parallel_iter(workers=2)), [])
+
+
+class TestGrep(unittest.TestCase):
+    def test_grep(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=500)
+            lines = [_rnd(random.randint(0, 30)) for _ in range(500)]
+            ld.append_many(lines)
+            expected = [line for line in lines if '123' in line]
+            self.assertGreater(len(expected), 0)
+            self.assertEqual(list(ld.grep('123', binary=False)), expected)
+            self.assertEqual(list(ld.grep(b'123')),
+                             [line.encode() for line in expected])
+
+
+class TestSketches(unittest.TestCase):
+    def test_files_skipped(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=300, sketches=True)
+            # not random, so the false positives of the filters are the
+            # same on each run
+            lines = [f'id={i} value{i * 7919 % 100000:05d}'
+                     for i in range(300)]
+            ld.append_many(lines)
+            self.assertTrue(
+                any(p.name.endswith('.bloom') for p in Path(tds).rglob('*')))
+            with mock.patch.object(LinesFile, 'grep', autospec=True,
+                                   side_effect=LinesFile.grep) as m:
+                self.assertEqual(list(ld.grep(r'\bid=123\b', binary=False,
+                                              tokens=['id', '123'])),
+                                 [lines[123]])
+                # the file with the line, the raw last file, and maybe
+                # a false positive
+                self.assertLessEqual(m.call_count, 3)
+            self.assertEqual(list(ld.grep(r'\bid=123\b')),
+                             [lines[123].encode()])
+            with self.assertRaises(ValueError):
+                list(ld.grep('id=1', tokens=['id=1']))
+
+    def test_rebuild(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=300)
+            lines = [f'id={i} {_rnd(20)}' for i in range(100)]
+            ld.append_many(lines)
+            compressed = sum(1 for p in Path(tds).rglob('*.gz'))
+            self.assertGreater(compressed, 3)
+            self.assertEqual(ld.rebuild_sketches(), compressed)
+            self.assertEqual(ld.rebuild_sketches(), 0)
+            self.assertEqual(ld.rebuild_sketches(force=True), compressed)
+            self.assertEqual(list(ld.grep('id=42 ', binary=False,
+                                          tokens=['42'])),
+                             [lines[42]])
+            self.assertEqual(list(ld), lines)
+
+
+def _timestamp(line: str) -> Optional[int]:
+    head = line.split(' ', 1)[0]
+    return int(head) if head.isdigit() else None
+
+
+class TestKeyRange(unittest.TestCase):
+    def test_range(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=300, key=_timestamp)
+            lines = []
+            for ts in range(1000, 1600, 2):
+                lines.append(f'{ts} {_rnd(20)}')
+                if ts % 100 == 0:
+                    lines.append('no timestamp')
+            ld.append_many(lines)
+
+            def expected(low, high):
+                return [line for line in lines
+                        if _timestamp(line) is not None
+                        and low <= _timestamp(line) < high]
+
+            for low, high in [(0, 10000), (1200, 1210), (1201, 1203),
+                              (1590, 1700), (0, 1000), (1598, 1599),
+                              (2000, 3000), (1300, 1200)]:
+                with self.subTest(low=low, high=high):
+                    self.assertEqual(list(ld.iter_range(low, high)),
+                                     expected(low, high))
+
+            with mock.patch.object(LinesFile, 'iter_str_lines',
+                                   autospec=True,
+                                   side_effect=LinesFile.iter_str_lines) as m:
+                self.assertEqual(list(ld.iter_range(1300, 1310)),
+                                 expected(1300, 1310))
+                # the files with the range, and the raw last file
+                self.assertLessEqual(m.call_count, 4)
+
+    def test_bounds_rebuilt(self):
+        with TemporaryDirectory() as tds:
+            lines = [f'{ts} {_rnd(20)}' for ts in range(1000, 1100)]
+            LinesDir(path=Path(tds), buffer_size=300).append_many(lines)
+            ld = LinesDir(path=Path(tds), key=_timestamp)
+            self.assertEqual(list(ld.iter_range(1050, 1060)), lines[50:60])
+            self.assertTrue((Path(tds) / 'key_bounds.txt').exists())
+            self.assertEqual(list(ld.iter_range(1050, 1060)), lines[50:60])
+
+    def test_keys_not_json(self):
+        def key(line: str) -> Optional[datetime.datetime]:
+            ts = _timestamp(line)
+            return None if ts is None \
+                else datetime.datetime.fromtimestamp(ts)
+
+        with TemporaryDirectory() as tds:
+            lines = [f'{ts} {_rnd(20)}' for ts in range(1000, 1100)]
+            ld = LinesDir(path=Path(tds), buffer_size=300, key=key)
+            ld.append_many(lines)
+            self.assertEqual(list(ld), lines)
+            low, high = (datetime.datetime.fromtimestamp(ts)
+                         for ts in [1050, 1060])
+            self.assertEqual(list(ld.iter_range(low, high)), lines[50:60])
+            # the bounds are kept only in memory
+            self.assertFalse((Path(tds) / 'key_bounds.txt').exists())
+            self.assertEqual(
+                list(LinesDir(path=Path(tds), key=key).iter_range(low, high)),
+                lines[50:60])
+
+    def test_no_key(self):
+        with TemporaryDirectory() as tds:
+            with self.assertRaises(ValueError):
+                list(LinesDir(path=Path(tds)).iter_range(0, 1))
+
+    def test_single_pass(self):
+        lines = [f'{ts} {_rnd(20)}' for ts in range(1000, 1100)]
+        for index_span in [None, 100]:
+            with self.subTest(index_span=index_span), \
+                    TemporaryDirectory() as tds:
+                ld = LinesDir(path=Path(tds), buffer_size=300,
+                              key=_timestamp, sketches=True,
+                              index_span=index_span)
+                # the lines are gathered while compressing
+                with mock.patch.object(
+                        LinesFile, '_iter_line_blocks', autospec=True,
+                        side_effect=LinesFile._iter_line_blocks) as m:
+                    ld.append_many(lines)
+                    self.assertEqual(m.call_count, 0)
+                self.assertEqual(list(ld.iter_range(1050, 1060)),
+                                 lines[50:60])
+                self.assertEqual(list(ld.grep('^1077 ', tokens=['1077'])),
+                                 [lines[77].encode()])
+                self.assertEqual(ld.stats().text_bytes,
+                                 sum(len(line) + 1 for line in lines))
+
+
+def _append_from_process(root: str, proc: int) -> None:
+    ld = LinesDir(path=Path(root), buffer_size=2000, multiprocess=True)
+    for i in range(150):
+        ld.append(f'process {proc} line {i} {_rnd(i % 40)}')
+    ld.append_many([f'process {proc} batch {i}' for i in range(150)])
+
+
+class TestMultiprocess(unittest.TestCase):
+    def test_file_modes(self):
+        # the files get the usual mode, like the ones made by open()
+        for multiprocess in [False, True]:
+            with self.subTest(multiprocess=multiprocess), \
+                    TemporaryDirectory() as tds:
+                reference = Path(tds) / 'reference'
+                reference.write_text('')
+                ld = LinesDir(path=Path(tds) / 'dir', buffer_size=100,
+                              multiprocess=multiprocess)
+                for _ in range(10):
+                    ld.append(_rnd(30))
+                files = [p for p in (Path(tds) / 'dir').rglob('*')
+                         if p.is_file()]
+                self.assertTrue(any(p.name.endswith('.txt.gz')
+                                    for p in files))
+                self.assertEqual(any(p.name == 'lock' for p in files),
+                                 multiprocess)
+                for file in files:
+                    self.assertEqual(file.stat().st_mode,
+                                     reference.stat().st_mode, file)
+
+    def test_appending_processes(self):
+        with TemporaryDirectory() as tds:
+            with ProcessPoolExecutor(4) as pool:
+                for f in [pool.submit(_append_from_process, tds, proc)
+                          for proc in range(4)]:
+                    f.result()
+            lines = list(LinesDir(path=Path(tds)))
+            self.assertEqual(len(lines), 4 * 300)
+            for proc in range(4):
+                mine = [line.split(' ', 4)[:4] for line in lines
+                        if line.startswith(f'process {proc} ')]
+                # each line once, in the order of appending
+                self.assertEqual(
+                    mine,
+                    [['process', str(proc), 'line', str(i)]
+                     for i in range(150)] +
+                    [['process', str(proc), 'batch', str(i)]
+                     for i in range(150)])
+            self.assertGreater(
+                sum(1 for _ in Path(tds).rglob('[0-9]*.txt.gz')), 3)
+            self.assertEqual(
+                [p for p in Path(tds).rglob('*.tmp')], [])
+
+    def test_no_writer(self):
+        with TemporaryDirectory() as tds:
+            with self.assertRaises(ValueError):
+                LinesDir(path=Path(tds), multiprocess=True).writer()
+
+    def test_locked_temp_file_kept(self):
+        from linecompress._locks import lock_fd
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=15)
+            ld.append_many(['line one', 'line two', 'line three'])
+            temp = Path(tds) / '000/000/001.txt.gz.tmp'
+            fd = os.open(temp, os.O_RDWR | os.O_CREAT)
+            try:
+                lock_fd(fd)
+                self.assertEqual(list(LinesDir(path=Path(tds))),
+                                 ['line one', 'line two', 'line three'])
+                self.assertTrue(temp.exists())
+            finally:
+                os.close(fd)
+            list(LinesDir(path=Path(tds)))
+            self.assertFalse(temp.exists())
+
+
+class TestDurability(unittest.TestCase):
+    def _fsyncs(self, durability: str, write, **kwargs) -> int:
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), durability=durability, **kwargs)
+            with mock.patch('os.fsync', wraps=os.fsync) as m:
+                write(ld)
+            self.assertEqual(len(list(ld)), 100)
+            return m.call_count
+
+    def test_modes(self):
+        def each(ld: LinesDir):
+            for i in range(100):
+                ld.append(f'line {i}')
+
+        def many(ld: LinesDir):
+            ld.append_many(f'line {i}' for i in range(100))
+
+        def writer(ld: LinesDir):
+            with ld.writer() as w:
+                for i in range(100):
+                    w.append(f'line {i}')
+
+        self.assertEqual(self._fsyncs('none', each), 0)
+        self.assertEqual(self._fsyncs('none', many, buffer_size=100), 0)
+        # the lines, and the three directories of the new file
+        self.assertEqual(self._fsyncs('batch', each), 100 + 3)
+        self.assertEqual(self._fsyncs('line', each), 100 + 3)
+        self.assertEqual(self._fsyncs('batch', many), 1 + 3)
+        self.assertEqual(self._fsyncs('line', writer), 100 + 1 + 3)
+        self.assertEqual(
+            self._fsyncs('interval', writer, fsync_interval=3600), 1 + 3)
+
+    def test_compression_synced(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=100, durability='batch')
+            with mock.patch('linecompress._file.fsync_dir',
+                            wraps=fsync_dir) as m:
+                ld.append_many(f'line {i}' for i in range(100))
+            compressed = sum(1 for _ in Path(tds).rglob('*.gz'))
+            self.assertGreater(compressed, 3)
+            self.assertEqual(m.call_count, compressed)
+
+    def test_unknown_mode(self):
+        with TemporaryDirectory() as tds:
+            with self.assertRaises(ValueError):
+                LinesDir(path=Path(tds), durability='always')
+
+
+class TestAsync(unittest.TestCase):
+    def test_append_and_read(self):
+        async def run(root: Path) -> List[str]:
+            adir = AsyncLinesDir(LinesDir(path=root, buffer_size=300),
+                                 chunk_lines=7)
+
+            async def produce(task: int):
+                for i in range(30):
+                    await adir.append(f'task {task} line {i}')
+
+            with mock.patch.object(LinesDir, 'append_many', autospec=True,
+                                   side_effect=LinesDir.append_many) as m:
+                await asyncio.gather(*(produce(t) for t in range(5)))
+                await adir.append_many(['last one', 'last two'])
+                # the concurrent appends are written together
+                self.assertLess(m.call_count, 5 * 30)
+            self.assertEqual([line async for line in adir.reversed()][:2],
+                             ['last two', 'last one'])
+            return [line async for line in adir]
+
+        with TemporaryDirectory() as tds:
+            lines = asyncio.run(run(Path(tds)))
+            self.assertEqual(lines, list(LinesDir(path=Path(tds))))
+            self.assertEqual(len(lines), 5 * 30 + 2)
+            for task in range(5):
+                self.assertEqual(
+                    [line for line in lines
+                     if line.startswith(f'task {task} ')],
+                    [f'task {task} line {i}' for i in range(30)])
+            self.assertGreater(
+                sum(1 for _ in Path(tds).rglob('[0-9]*.txt.gz')), 3)
+
+    def test_errors(self):
+        async def run(root: Path):
+            adir = AsyncLinesDir(LinesDir(path=root))
+            with self.assertRaises(ValueError):
+                await adir.append('two\nlines')
+            with mock.patch.object(LinesDir, 'append_many',
+                                   side_effect=OSError('disk full')):
+                with self.assertRaises(OSError):
+                    await adir.append('line')
+            await adir.append('line')
+            self.assertEqual([line async for line in adir], ['line'])
+
+        with TemporaryDirectory() as tds:
+            asyncio.run(run(Path(tds)))
+
+
+class TestFollow(unittest.TestCase):
+    def _follow_while_writing(self, root: Path, existing: int,
+                              **kwargs) -> List[str]:
+        ld = LinesDir(path=root, buffer_size=300)
+        ld.append_many(f'old {i}' for i in range(existing))
+        followed = iter(ld.follow(poll_interval=0.05, **kwargs))
+        lines = [f'new {i} {_rnd(i % 30)}' for i in range(200)]
+
+        def write():
+            for i, line in enumerate(lines):
+                ld.append(line)
+                if i % 20 == 0:
+                    time.sleep(0.01)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        result = [next(followed) for _ in range(kwargs.get('start', existing),
+                                                existing + len(lines))]
+        writer.join()
+        self.assertGreater(sum(1 for _ in root.rglob('[0-9]*.txt.gz')), 3)
+        return result
+
+    def test_new_lines(self):
+        with TemporaryDirectory() as tds:
+            self.assertEqual(
+                self._follow_while_writing(Path(tds), existing=15),
+                [line for line in LinesDir(path=Path(tds))
+                 if line.startswith('new ')])
+
+    def test_from_line(self):
+        with TemporaryDirectory() as tds:
+            self.assertEqual(
+                self._follow_while_writing(Path(tds), existing=50, start=42),
+                list(LinesDir(path=Path(tds)))[42:])
+
+    def test_from_line_not_written(self):
+        with TemporaryDirectory() as tds:
+            self.assertEqual(
+                self._follow_while_writing(Path(tds), existing=10, start=15),
+                list(LinesDir(path=Path(tds)))[15:])
+
+    def test_from_line_not_written_in_compressed(self):
+        with TemporaryDirectory() as tds:
+            old = LinesDir(path=Path(tds), buffer_size=50)
+            old.append_many(f'old {i}' for i in range(20))
+            old._compress_now(old._numerically_last_file())
+            ld = LinesDir(path=Path(tds), buffer_size=50)
+            self.assertTrue(all(p.name.endswith('.txt.gz')
+                                for p in Path(tds).rglob('[0-9]*.txt*')))
+            followed = iter(ld.follow(start=25, poll_interval=0.05))
+            ld.append_many(f'new {i}' for i in range(20, 30))
+            self.assertEqual([next(followed) for _ in range(5)],
+                             [f'new {i}' for i in range(25, 30)])
+
+    def test_polling(self):
+        with TemporaryDirectory() as tds:
+            with mock.patch('linecompress._watch._load_libc',
+                            return_value=None):
+                self.assertEqual(
+                    self._follow_while_writing(Path(tds), existing=0),
+                    list(LinesDir(path=Path(tds))))
+
+    def test_unfinished_line_waits(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds))
+            ld.append('one')
+            followed = iter(ld.follow(start=0, binary=True,
+                                      poll_interval=0.05))
+            self.assertEqual(next(followed), b'one')
+            with (Path(tds) / '000/000/000.txt').open('ab') as f:
+                f.write(b'tw')
+                f.flush()
+                threading.Timer(0.2, lambda: ld.append('three')).start()
+                time.sleep(0.1)
+                f.write(b'o\n')
+            self.assertEqual([next(followed), next(followed)],
+                             [b'two', b'three'])
+
+
+class TestCursors(unittest.TestCase):
+    def test_resume(self):
+        with TemporaryDirectory() as tds:
+            for index_span in [None, 50]:
+                ld = LinesDir(path=Path(tds) / str(index_span),
+                              buffer_size=300, index_span=index_span)
+                lines = [f'line {i} {_rnd(i % 30)}' for i in range(200)]
+                ld.append_many(lines)
+                with_cursors = list(ld.iter_with_cursors())
+                self.assertEqual([line for line, _ in with_cursors], lines)
+                for stop in [0, 1, 57, 100, 198, 199]:
+                    with self.subTest(index_span=index_span, stop=stop):
+                        saved = str(with_cursors[stop][1])
+                        self.assertEqual(
+                            list(ld.iter_with_cursors(
+                                after=Cursor.parse(saved))),
+                            with_cursors[stop + 1:])
+
+    def test_only_cursor_file_reread(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=300)
+            ld.append_many(f'line {i} {_rnd(20)}' for i in range(200))
+            cursor = list(ld.iter_with_cursors())[150][1]
+            files = list(ld._recurse_files(reverse=False))
+            with mock.patch.object(LinesFile, 'iter_blocks_from',
+                                   autospec=True,
+                                   side_effect=LinesFile.iter_blocks_from) \
+                    as m:
+                self.assertEqual(
+                    [line for line, _ in ld.iter_with_cursors(after=cursor,
+                                                              binary=True)],
+                    list(ld.iter_byte_lines())[151:])
+                self.assertEqual(
+                    m.call_count,
+                    sum(1 for f in files if ld._file_num(f) >= cursor.num))
+
+    def test_unfinished_line(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds))
+            ld.append('one')
+            raw = Path(tds) / '000/000/000.txt'
+            with raw.open('ab') as f:
+                f.write(b'tw')
+            self.assertEqual(list(ld.iter_with_cursors()),
+                             [('one', Cursor(0, 4))])
+            with raw.open('ab') as f:
+                f.write(b'o\n')
+            self.assertEqual(list(ld.iter_with_cursors(after=Cursor(0, 4))),
+                             [('two', Cursor(0, 8))])
+            self.assertEqual(
+                next(iter(ld.follow(start=Cursor(0, 4)))), 'two')
+
+    def test_parse(self):
+        self.assertEqual(Cursor.parse('12:3456'), Cursor(12, 3456))
+        self.assertEqual(str(Cursor(12, 3456)), '12:3456')
+        for text in ['', '12', '12:', 'a:1', '1:2:3', '-1:5']:
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    Cursor.parse(text)
+
+
+class TestRetention(unittest.TestCase):
+    def _fill(self, root: Path, **kwargs) -> List[str]:
+        # starting near the end of a directory, to see it removed
+        (root / '000/000').mkdir(parents=True)
+        (root / '000/000/998.txt').write_text('first\n')
+        lines = ['first'] + [f'line {i} {_rnd(30)}' for i in range(100)]
+        LinesDir(path=root, buffer_size=200, **kwargs).append_many(lines[1:])
+        return lines
+
+    def _files(self, root: Path) -> List[str]:
+        return sorted({str(p.relative_to(root)).split('.')[0]
+                       for p in root.rglob('[0-9]*.txt*')})
+
+    def test_max_files(self):
+        with TemporaryDirectory() as tds:
+            root = Path(tds)
+            lines = self._fill(root, sketches=True, index_span=100)
+            files = self._files(root)
+            ld = LinesDir(path=root)
+            self.assertEqual(ld.prune(Retention(max_files=3)),
+                             len(files) - 3)
+            self.assertEqual(self._files(root), files[-3:])
+            self.assertFalse((root / '000/000').exists())
+            # the sidecars are removed too
+            self.assertEqual(len(list(root.rglob('*.bloom'))), 2)
+            remaining = list(ld)
+            self.assertEqual(remaining, lines[-len(remaining):])
+            self.assertEqual(ld.prune(Retention(max_files=3)), 0)
+
+    def test_background_compression(self):
+        with TemporaryDirectory() as tds:
+            root = Path(tds)
+            ld = LinesDir(path=root, buffer_size=100,
+                          background_compression=True,
+                          retention=Retention(max_files=1))
+            lines = [f'line {i} {_rnd(30)}' for i in range(200)]
+            for line in lines:
+                ld.append(line)
+            ld.wait_compressed()
+            ld.prune()
+            self.assertEqual(len(self._files(root)), 1)
+            remaining = list(ld)
+            self.assertEqual(remaining, lines[-len(remaining):])
+
+    def test_max_bytes(self):
+        with TemporaryDirectory() as tds:
+            root = Path(tds)
+            self._fill(root)
+            ld = LinesDir(path=root)
+            ld.prune(Retention(max_bytes=500))
+            sizes = [p.stat().st_size for p in root.rglob('[0-9]*.txt*')]
+            self.assertLessEqual(sum(sizes), 500)
+            self.assertGreater(sum(sizes) + 200, 500)
+            # the last file is always kept
+            ld.prune(Retention(max_bytes=0))
+            self.assertEqual(len(self._files(root)), 1)
+
+    def test_max_age(self):
+        with TemporaryDirectory() as tds:
+            root = Path(tds)
+            self._fill(root)
+            files = sorted(root.rglob('[0-9]*.txt*'))
+            old = time.time() - 1000
+            for file in files[:4]:
+                os.utime(file, (old, old))
+            self.assertEqual(LinesDir(path=root).prune(Retention(max_age=500)),
+                             4)
+            self.assertEqual(sorted(root.rglob('[0-9]*.txt*')), files[4:])
+
+    def test_min_key(self):
+        with TemporaryDirectory() as tds:
+            root = Path(tds)
+            ld = LinesDir(path=root, buffer_size=300, key=_timestamp)
+            lines = [f'{ts} {_rnd(20)}' for ts in range(1000, 1200)]
+            ld.append_many(lines)
+            ld.prune(Retention(min_key=1100))
+            remaining = list(ld)
+            self.assertEqual(remaining, lines[-len(remaining):])
+            self.assertLessEqual(_timestamp(remaining[0]), 1100)
+            self.assertGreater(len(remaining), 90)
+            with self.assertRaises(ValueError):
+                LinesDir(path=root).prune(Retention(min_key=1100))
+
+    def test_incremental(self):
+        with TemporaryDirectory() as tds:
+            root = Path(tds)
+            ld = LinesDir(path=root, buffer_size=200,
+                          retention=Retention(max_files=4))
+            with mock.patch.object(LinesDir, '_recurse_files', autospec=True,
+                                   side_effect=LinesDir._recurse_files) as m:
+                ld.append_many(f'line {i} {_rnd(30)}' for i in range(100))
+            # pruned when the file was compressed, before the next one
+            # was started
+            self.assertEqual(len(self._files(root)), 4 + 1)
+            starts = [c.kwargs.get('start') for c in m.call_args_list
+                      if not c.kwargs['reverse']]
+            # only the first pruning lists the files from the start
+            self.assertEqual(starts.count(None), 1)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_collected(self):
+        with TemporaryDirectory() as tds:
+            metrics = MetricsCollector()
+            ld = LinesDir(path=Path(tds), buffer_size=300, observer=metrics)
+            lines = [f'line {i} {_rnd(20)}' for i in range(100)]
+            for line in lines[:50]:
+                ld.append(line)
+            ld.append_many(lines[50:])
+            self.assertEqual(list(ld), lines)
+
+            snapshot = metrics.snapshot()
+            json.dumps(snapshot)
+            counters = snapshot['counters']
+            timings = snapshot['timings']
+            files = sorted(Path(tds).rglob('[0-9]*.txt*'))
+            compressed = [f for f in files if f.suffix == '.gz']
+            self.assertEqual(counters['lines_in'], 100)
+            self.assertEqual(counters['bytes_in'],
+                             sum(len(line) + 1 for line in lines))
+            self.assertEqual(counters['bytes_out'],
+                             sum(f.stat().st_size for f in compressed))
+            self.assertEqual(counters['segment_open'], len(files))
+            self.assertGreater(counters['walk'], 0)
+            self.assertEqual(timings['append']['count'], 50)
+            self.assertEqual(timings['compress']['count'], len(compressed))
+            self.assertEqual(timings['rollover']['count'], len(compressed))
+            self.assertGreater(timings['dir_listing']['count'], 0)
+            append = timings['append']
+            self.assertLessEqual(append['min'], append['p50'])
+            self.assertLessEqual(append['p50'], append['p99'])
+            self.assertEqual(sum(append['buckets'].values()) + append['above'],
+                             50)
+            metrics.reset()
+            self.assertEqual(metrics.snapshot(),
+                             {'counters': {}, 'timings': {}})
+
+    def test_custom_observer(self):
+        class Counting(Observer):
+            def __init__(self):
+                self.names = set()
+
+            def count(self, name: str, value: int = 1) -> None:
+                self.names.add(name)
+
+        with TemporaryDirectory() as tds:
+            observer = Counting()
+            ld = LinesDir(path=Path(tds), observer=observer)
+            ld.append('line')
+            self.assertEqual(observer.names, {'lines_in', 'bytes_in', 'walk'})
+
+
+class TestCatalog(unittest.TestCase):
+    def _touch(self, root: Path, names: List[str]):
+        for name in names:
+            file = root / name
+            file.parent.mkdir(parents=True, exist_ok=True)
+            file.touch()
+
+    def test_walk(self):
+        with TemporaryDirectory() as tds:
+            root = Path(tds)
+            self._touch(root, ['000/000/000.txt.gz', '000/000/001.txt.gz',
+                               '000/000/001.txt.gz.idx', '000/000/002.txt',
+                               '000/000/002.txt.gz', '000/000/003.txt',
+                               '000/000/003.txt.gz.tmp', '000/000/abc.txt',
+                               '000/002/999.txt.xz', '001/000/005.txt',
+                               '001/001'])
+            expected = ['000/000/000.txt.gz', '000/000/001.txt.gz',
+                        '000/000/002.txt.gz', '000/000/003.txt',
+                        '000/002/999.txt.xz', '001/000/005.txt']
+            segments = list(iter_segments(root, 2))
+            self.assertEqual([s.path for s in segments],
+                             [root / name for name in expected])
+            self.assertEqual([s.num for s in segments],
+                             [0, 1, 2, 3, 2999, 1000005])
+            self.assertEqual([s.num for s in iter_segments(root, 2,
+                                                           reverse=True)],
+                             [1000005, 2999, 3, 2, 1, 0])
+            for start, nums in [(2, [2, 3, 2999, 1000005]),
+                                (4, [2999, 1000005]),
+                                (3000, [1000005]),
+                                (1000006, [])]:
+                self.assertEqual([s.num for s in iter_segments(
+                    root, 2, start=start)], nums)
+            self.assertEqual(list(LinesDir(root)._walk_files(reverse=False)),
+                             [root / name for name in expected])
+
+    def test_catalog(self):
+        with TemporaryDirectory() as tds:
+            root = Path(tds)
+            self._touch(root, ['000/000/000.txt.gz', '000/000/001.txt',
+                               '000/001/002.txt.xz', '000/001/003extra',
+                               '000/002/1234.txt'])
+            catalog = SegmentCatalog.scan(root, 2)
+            self.assertEqual(list(catalog.nums), [0, 1, 1002, 1003, 3234])
+            self.assertEqual(list(catalog.paths()),
+                             [root / '000/000/000.txt.gz',
+                              root / '000/000/001.txt',
+                              root / '000/001/002.txt.xz',
+                              root / '000/001/003extra',
+                              root / '000/002/1234.txt'])
+            self.assertEqual(list(catalog.paths(start=2)),
+                             [root / '000/001/002.txt.xz',
+                              root / '000/001/003extra',
+                              root / '000/002/1234.txt'])
+            self.assertEqual(list(catalog.paths(start=2, reverse=True)),
+                             [root / '000/000/001.txt',
+                              root / '000/000/000.txt.gz'])
+            self.assertEqual(list(catalog.paths(start=1003, reverse=True)),
+                             [root / '000/001/003extra',
+                              root / '000/001/002.txt.xz',
+                              root / '000/000/001.txt',
+                              root / '000/000/000.txt.gz'])
+            self.assertEqual(list(catalog.paths(reverse=True)),
+                             list(reversed(list(catalog.paths()))))
+            self.assertEqual(list(catalog.paths(start=-1, reverse=True)), [])
+            self.assertIn(1002, catalog)
+            self.assertNotIn(2, catalog)
+            self.assertEqual(catalog.index(2), 2)
+            with self.assertRaises(ValueError):
+                catalog.add(next(iter_segments(root, 2)))
+
+    def test_dir_catalog(self):
+        for manifest in [False, True]:
+            with TemporaryDirectory() as tds:
+                ld = LinesDir(path=Path(tds), buffer_size=200,
+                              subdirs=1, manifest=manifest)
+                ld.append_many(_rnd(50) for _ in range(40))
+                catalog = ld.catalog()
+                self.assertEqual(list(catalog.paths()),
+                                 list(ld._recurse_files(reverse=False)))
+                self.assertEqual(len(catalog), 10)
+
+
+class TestStats(unittest.TestCase):
+    def test_stats(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=200)
+            self.assertEqual(ld.stats(), DirStats(0, 0, 0, 0, 0))
+            lines = [_rnd(50) for _ in range(103)]
+            ld.append_many(lines)
+            files = list(ld._recurse_files(reverse=False))
+            stats = ld.stats()
+            self.assertEqual(stats.files, len(files))
+            self.assertEqual(stats.compressed_files, len(files) - 1)
+            self.assertEqual(stats.lines, len(lines))
+            self.assertEqual(stats.disk_bytes,
+                             sum(f.stat().st_size for f in files))
+            self.assertEqual(stats.text_bytes, 51 * len(lines))
+            self.assertAlmostEqual(stats.ratio,
+                                   stats.text_bytes / stats.disk_bytes)
+
+            def reading_files() -> int:
+                with mock.patch.object(
+                        LinesFile, '_iter_line_blocks', autospec=True,
+                        side_effect=LinesFile._iter_line_blocks) as m:
+                    self.assertEqual(
+                        LinesDir(path=Path(tds), buffer_size=200).stats(),
+                        stats)
+                return m.call_count
+
+            # only the raw file is read
+            self.assertEqual(reading_files(), 1)
+            # the files compressed by older versions are read once
+            (Path(tds) / 'line_counts.txt').unlink()
+            (Path(tds) / 'text_sizes.txt').unlink()
+            self.assertEqual(reading_files(), len(files))
+            self.assertEqual(reading_files(), 1)
+
+    def test_members_without_index(self):
+        with TemporaryDirectory() as tds:
+            root = Path(tds)
+            ld = LinesDir(path=root, buffer_size=1000, index_span=100)
+            lines = [_rnd(50) for _ in range(100)]
+            ld.append_many(lines)
+            ld.append('last')
+            for index in root.rglob('*.idx'):
+                index.unlink()
+            (root / 'line_counts.txt').unlink()
+            (root / 'text_sizes.txt').unlink()
+            stats = LinesDir(path=root).stats()
+            self.assertEqual(stats.lines, 101)
+            self.assertEqual(stats.text_bytes, 51 * 100 + 5)
+
+
+class TestChunks(unittest.TestCase):
+    def test_chunks(self):
+        with TemporaryDirectory() as tds:
+            ld = LinesDir(path=Path(tds), buffer_size=200)
+            lines = [_rnd(50) for _ in range(103)]
+            ld.append_many(lines)
+            for start in [0, 1, 50, 102, 103, 200]:
+                with self.subTest(start=start):
+                    chunks = list(ld.iter_chunks(start=start))
+                    self.assertTrue(all(c.endswith(b'\n') for c in chunks))
+                    self.assertEqual(
+                        b''.join(chunks),
+                        ''.join(s + '\n' for s in lines[start:]).encode())
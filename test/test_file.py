@@ -1,11 +1,23 @@
+import gzip
+import io
 import os
+import re
 import unittest
 from pathlib import Path
+from typing import List
+from unittest import mock
 from tempfile import TemporaryDirectory
 
+from linecompress._codecs import Codec, GzipCodec, LzmaCodec, Bz2Codec, \
+    ZstdCodec, Lz4Codec
+from linecompress._grep import matching_lines, compile_pattern
 from linecompress._file import _remove_suffix, to_compressed_path, \
     to_rawdata_path, \
-    to_dirty_path, LinesFile
+    to_dirty_path, LinesFile, _line_blocks, _without_last_newline, \
+    compressed_paths
+from linecompress._sketch import TokenSketch, tokens_of
+from linecompress._reverse import _reversed_lines, _raw_blocks_from_end, \
+    _gzip_blocks_from_end
 
 
 class TestFile(unittest.TestCase):
@@ -114,6 +126,31 @@ class TestFile(unittest.TestCase):
                 to_rawdata_path(src),
                 Path('/path/to/my.file.name.txt'))
 
+    def test_temp_removed_before_rename(self):
+        # without renaming the locked files, a cleanup may remove the
+        # finished temporary file before it is renamed
+        real_rename = os.rename
+        removed = []
+
+        def rename(source, target):
+            if not removed:
+                removed.append(source)
+                os.remove(source)
+                raise FileNotFoundError(source)
+            real_rename(source, target)
+
+        with TemporaryDirectory() as tds:
+            file = Path(tds) / "data.txt"
+            lines = [f'line {i}' for i in range(100)]
+            file.write_text(''.join(line + '\n' for line in lines))
+            lf = LinesFile(file)
+            with mock.patch('linecompress._file.CAN_RENAME_LOCKED', False), \
+                    mock.patch('os.rename', side_effect=rename):
+                self.assertEqual(lf.compress(), len(lines))
+            self.assertEqual(len(removed), 1)
+            self.assertEqual(os.listdir(tds), ['data.txt.gz'])
+            self.assertEqual(list(LinesFile(file)), lines)
+
 
 class TestBinary(unittest.TestCase):
     def test(self):
@@ -129,3 +166,357 @@ class TestBinary(unittest.TestCase):
             cl.append('Third line')
             self.assertEqual(list(cl.iter_byte_lines()),
                              [b'line one', b'line two', b'Third line'])
+
+
+class TestStreaming(unittest.TestCase):
+    def test_line_blocks(self):
+        data = b'one\ntwo\n\nthree four five\nsix'
+        for chunk_size in [1, 2, 3, 5, 8, 100]:
+            with self.subTest(chunk_size):
+                blocks = list(_line_blocks(io.BytesIO(data), chunk_size))
+                self.assertEqual(b''.join(blocks), data)
+                self.assertTrue(all(b.endswith(b'\n') for b in blocks[:-1]))
+                self.assertEqual(blocks[-1], b'six')
+
+    def test_first_line_without_reading_all(self):
+        stream = io.BytesIO(b'first\n' + b'x' * 100000 + b'\n')
+        blocks = _line_blocks(stream, chunk_size=16)
+        self.assertEqual(next(blocks), b'first\n')
+        self.assertLess(stream.tell(), 100)
+
+    def test_unfinished_last_line(self):
+        with TemporaryDirectory() as tds:
+            file = Path(tds) / "data.txt"
+            file.write_bytes('line one\nстрока два'.encode('utf-8'))
+            cl = LinesFile(file)
+            self.assertEqual(list(cl), ['line one', 'строка два'])
+            cl.compress()
+            self.assertEqual(list(cl.iter_byte_lines()),
+                             [b'line one', 'строка два'.encode('utf-8')])
+
+    def test_line_views(self):
+        def bytes_of_views(lf: LinesFile) -> List[bytes]:
+            with lf.line_views() as views:
+                return [bytes(v) for v in views]
+
+        with TemporaryDirectory() as tds:
+            file = Path(tds) / "data.txt"
+            lf = LinesFile(file)
+            self.assertEqual(bytes_of_views(lf), [])
+            file.touch()
+            self.assertEqual(bytes_of_views(lf), [])
+            for data in [b'one\n\nthree\n', b'one\n\nthree\nfour']:
+                with self.subTest(data=data):
+                    file.write_bytes(data)
+                    lf = LinesFile(file)
+                    expected = list(lf.iter_byte_lines())
+                    with lf.line_views() as views:
+                        kept = list(views)
+                        self.assertTrue(all(isinstance(v, memoryview)
+                                            for v in kept))
+                        self.assertEqual([bytes(v) for v in kept], expected)
+                        # so the mapping is closed at the end of the block
+                        for view in kept:
+                            view.release()
+                    mapped = lf._mapped()
+                    assert mapped is not None
+                    with mock.patch.object(LinesFile, '_mapped',
+                                           return_value=mapped):
+                        self.assertEqual(bytes_of_views(lf), expected)
+                    self.assertTrue(mapped.closed)
+                    with mock.patch('linecompress._file.CAN_RENAME_LOCKED',
+                                    False):
+                        self.assertEqual(bytes_of_views(lf), expected)
+                    lf.compress()
+                    self.assertEqual(bytes_of_views(lf), expected)
+                    os.remove(Path(tds) / "data.txt.gz")
+
+    def test_chunks(self):
+        lines = [f'line {i}' for i in range(10000)]
+        data = ''.join(line + '\n' for line in lines).encode()
+        with TemporaryDirectory() as tds:
+            file = Path(tds) / "data.txt"
+            file.write_bytes(data)
+            lf = LinesFile(file)
+            for compress in [False, True]:
+                if compress:
+                    lf.compress()
+                for start in [0, 1, 9999, 10000]:
+                    with self.subTest(compress=compress, start=start):
+                        chunks = list(lf.iter_chunks(start=start))
+                        self.assertTrue(all(c.endswith(b'\n')
+                                            for c in chunks))
+                        self.assertEqual(
+                            b''.join(chunks),
+                            ''.join(s + '\n' for s in lines[start:]).encode())
+
+
+class TestReverse(unittest.TestCase):
+    def test_reversed_lines(self):
+        for data in [b'', b'\n', b'\n\n', b'one', b'one\n', b'one\ntwo',
+                     b'one\n\ntwo\n', b'\none\n\n\ntwo\n\n']:
+            expected = [] if not data else list(reversed(
+                _without_last_newline(data).split(b'\n')))
+            for chunk_size in [1, 2, 3, 100]:
+                with self.subTest(data=data, chunk_size=chunk_size):
+                    blocks = _raw_blocks_from_end(io.BytesIO(data),
+                                                  chunk_size)
+                    self.assertEqual(list(_reversed_lines(blocks)),
+                                     expected)
+
+    def test_gzip_spans(self):
+        lines = [f'line {i} '.encode() * (i % 7) for i in range(3000)]
+        data = b'\n'.join(lines) + b'\n'
+        # two members, as if the files were concatenated
+        compressed = gzip.compress(data[:10000]) + gzip.compress(data[10000:])
+        for span in [7, 100, 4096, 1 << 20]:
+            with self.subTest(span):
+                blocks = list(
+                    _gzip_blocks_from_end(io.BytesIO(compressed), span))
+                self.assertEqual(b''.join(reversed(blocks)), data)
+                self.assertTrue(all(len(b) <= span for b in blocks))
+
+    def test_truncated_gzip(self):
+        compressed = gzip.compress(b'line\n' * 1000)
+        with self.assertRaises(EOFError):
+            list(_gzip_blocks_from_end(io.BytesIO(compressed[:-20])))
+
+    def test_file(self):
+        dancing_file = (Path(__file__).parent / "data" / "dancing.txt")
+        lines = dancing_file.read_text().splitlines()
+        with TemporaryDirectory() as tds:
+            cl = LinesFile(Path(tds) / "data.txt")
+            for line in lines:
+                cl.append(line)
+            self.assertEqual(list(reversed(cl)), list(reversed(lines)))
+            cl.compress()
+            self.assertEqual(list(reversed(cl)), list(reversed(lines)))
+            self.assertEqual(
+                list(cl.iter_byte_lines(reverse=True)),
+                [line.encode('utf-8') for line in reversed(lines)])
+
+    def test_read_empty(self):
+        with TemporaryDirectory() as tds:
+            self.assertEqual(list(reversed(LinesFile(Path(tds) / "a.txt"))),
+                             [])
+
+
+class TestIndex(unittest.TestCase):
+    def _create(self, tds: str, lines, index_span) -> LinesFile:
+        file = Path(tds) / "data.txt"
+        file.write_bytes(b''.join(line.encode() + b'\n' for line in lines))
+        lf = LinesFile(file)
+        lf.compress(index_span=index_span)
+        return lf
+
+    def test_is_plain_gzip(self):
+        lines = [f'line {i}' for i in range(1000)]
+        with TemporaryDirectory() as tds:
+            lf = self._create(tds, lines, index_span=500)
+            gz_file = Path(tds) / "data.txt.gz"
+            self.assertEqual(gzip.decompress(gz_file.read_bytes()).decode(),
+                             ''.join(line + '\n' for line in lines))
+            index = lf._load_index()
+            assert index is not None
+            self.assertGreater(len(index.points), 10)
+            self.assertEqual(index.lines, 1000)
+            self.assertEqual(list(lf), lines)
+            self.assertEqual(list(reversed(lf)), list(reversed(lines)))
+
+    def test_start(self):
+        lines = [f'line {i}' for i in range(1000)]
+        with TemporaryDirectory() as tds:
+            for index_span in [None, 1, 100, 10000]:
+                lf = self._create(tds, lines, index_span=index_span)
+                for start in [0, 1, 77, 500, 999, 1000, 2000]:
+                    with self.subTest(index_span=index_span, start=start):
+                        self.assertEqual(list(lf.iter_str_lines(start=start)),
+                                         lines[start:])
+                os.remove(Path(tds) / "data.txt.gz")
+
+    def test_offset_of_line(self):
+        lines = [f'line {i}' for i in range(1000)]
+        data = ''.join(line + '\n' for line in lines).encode()
+        with TemporaryDirectory() as tds:
+            for index_span in [None, 1, 100]:
+                lf = self._create(tds, lines, index_span=index_span)
+                for line in [0, 1, 77, 500, 999, 1000, 2000]:
+                    with self.subTest(index_span=index_span, line=line):
+                        offset = lf.offset_of_line(line)
+                        self.assertEqual(
+                            offset,
+                            len(''.join(s + '\n' for s in lines[:line])))
+                        self.assertEqual(b''.join(lf.iter_blocks_from(offset)),
+                                         data[offset:])
+                os.remove(Path(tds) / "data.txt.gz")
+
+    def test_restart_point(self):
+        lines = [f'line {i}' for i in range(10000)]
+        with TemporaryDirectory() as tds:
+            lf = self._create(tds, lines, index_span=1000)
+            point = lf._restart_point(line=9990)
+            self.assertLessEqual(point.line, 9990)
+            self.assertGreater(point.line, 9800)
+            self.assertGreater(point.in_offset, 0)
+
+    def test_read_bytes(self):
+        lines = [f'line {i}' for i in range(1000)]
+        data = ''.join(line + '\n' for line in lines).encode()
+        with TemporaryDirectory() as tds:
+            for index_span in [None, 100]:
+                lf = self._create(tds, lines, index_span=index_span)
+                for offset in [0, 5, 1234, len(data) - 3]:
+                    with self.subTest(index_span=index_span, offset=offset):
+                        self.assertEqual(lf.read_bytes(offset, 20),
+                                         data[offset:offset + 20])
+                os.remove(Path(tds) / "data.txt.gz")
+
+    def test_stale_index_ignored(self):
+        with TemporaryDirectory() as tds:
+            lf = self._create(tds, ['a', 'b', 'c'], index_span=1)
+            (Path(tds) / "data.txt.gz").write_bytes(
+                gzip.compress(b'x\ny\nz\n'))
+            self.assertIsNone(lf._load_index())
+            self.assertEqual(list(lf.iter_str_lines(start=2)), ['z'])
+
+    def test_empty(self):
+        with TemporaryDirectory() as tds:
+            lf = self._create(tds, [], index_span=100)
+            self.assertEqual(list(lf), [])
+            self.assertEqual(list(lf.iter_str_lines(start=5)), [])
+
+
+def _available_codecs() -> List[Codec]:
+    result: List[Codec] = [GzipCodec(), GzipCodec(level=1), LzmaCodec(),
+                           Bz2Codec()]
+    for codec_type in [ZstdCodec, Lz4Codec]:
+        try:
+            result.append(codec_type())
+        except ImportError:
+            pass
+    return result
+
+
+class TestCodecs(unittest.TestCase):
+    def test_names(self):
+        self.assertEqual(_remove_suffix('my.name.txt.xz'), 'my.name')
+        self.assertEqual(_remove_suffix('my.name.txt.bz2.tmp'), 'my.name')
+        self.assertEqual(
+            to_compressed_path(Path('/path/to/my.name.txt.gz'), '.zst'),
+            Path('/path/to/my.name.txt.zst'))
+        self.assertEqual(
+            compressed_paths(Path('/path/to/000.txt.xz'))[:2],
+            [Path('/path/to/000.txt.xz'), Path('/path/to/000.txt.gz')])
+
+    def test_codecs(self):
+        dancing_file = (Path(__file__).parent / "data" / "dancing.txt")
+        lines = dancing_file.read_text().splitlines()
+        for codec in _available_codecs():
+            for index_span in [None, 10000]:
+                with self.subTest(codec=codec, index_span=index_span), \
+                        TemporaryDirectory() as tds:
+                    lf = LinesFile(Path(tds) / "data.txt")
+                    for line in lines:
+                        lf.append(line)
+                    self.assertEqual(lf.compress(index_span=index_span,
+                                                 codec=codec), len(lines))
+                    self.assertIn('data.txt' + codec.suffix,
+                                  os.listdir(tds))
+
+                    # the format is detected by the suffix
+                    lf = LinesFile(Path(tds) / "data.txt")
+                    self.assertTrue(lf.is_compressed)
+                    self.assertEqual(list(lf), lines)
+                    self.assertEqual(list(reversed(lf)),
+                                     list(reversed(lines)))
+                    self.assertEqual(list(lf.iter_str_lines(start=1000)),
+                                     lines[1000:])
+                    self.assertEqual(lf.count_lines(), len(lines))
+                    self.assertEqual(lf.text_size(),
+                                     dancing_file.stat().st_size)
+
+
+class TestGrep(unittest.TestCase):
+    def test_matching_lines(self):
+        block = b'one\ntwo\n\nthree two\nfour'
+        for pattern, expected in [
+            (b'two', [b'two', b'three two']),
+            (b'o', [b'one', b'two', b'three two', b'four']),
+            (b'^$', [b'']),
+            (b'^t', [b'two', b'three two']),
+            (b'r$', [b'four']),
+            (b'five', []),
+            (rb'\W', [b'three two']),
+            (rb'\s', [b'three two']),
+            (b'[^a-z]', [b'three two']),
+            (rb'o\n', []),
+            (rb'(?s)e.t', [b'three two']),
+            (rb'(?s)o.t', []),
+            (b'$', [b'one', b'two', b'', b'three two', b'four']),
+        ]:
+            with self.subTest(pattern):
+                self.assertEqual(
+                    list(matching_lines(block,
+                                        compile_pattern(pattern, True))),
+                    expected)
+
+    def test_newline_in_match(self):
+        lines = ['aaa', 'bbb', 'a b']
+        block = ''.join(line + '\n' for line in lines)
+        self.assertEqual(list(matching_lines(block,
+                                             compile_pattern(r'\W', False))),
+                         ['a b'])
+        self.assertEqual(list(matching_lines(block[:-1],
+                                             compile_pattern(r'\W', False))),
+                         ['a b'])
+
+    def test_compile(self):
+        self.assertEqual(compile_pattern('ы', True).pattern,
+                         'ы'.encode('utf-8'))
+        self.assertEqual(compile_pattern(b'x', False).pattern, 'x')
+        with self.assertRaises(TypeError):
+            compile_pattern(re.compile('x'), True)
+
+    def test_file(self):
+        dancing_file = (Path(__file__).parent / "data" / "dancing.txt")
+        lines = dancing_file.read_text().splitlines()
+        with TemporaryDirectory() as tds:
+            lf = LinesFile(Path(tds) / "data.txt")
+            for line in lines:
+                lf.append(line)
+            lf.compress()
+            expected = [line for line in lines
+                        if re.search(r'\bdanc', line, re.IGNORECASE)]
+            self.assertGreater(len(expected), 10)
+            self.assertEqual(
+                list(lf.grep(re.compile(r'\bdanc', re.IGNORECASE),
+                             binary=False)),
+                expected)
+            self.assertEqual(list(lf.grep(r'(?i)\bdanc')),
+                             [line.encode() for line in expected])
+
+
+class TestSketch(unittest.TestCase):
+    def test_tokens(self):
+        self.assertEqual(tokens_of('a-b c_d, слово 12\n'.encode()),
+                         {b'a', b'b', b'c_d', 'слово'.encode(), b'12'})
+
+    def test_no_false_negatives(self):
+        tokens = [str(i).encode() for i in range(0, 20000, 2)]
+        sketch = TokenSketch.build([b' '.join(tokens)])
+        self.assertTrue(all(sketch.may_contain(t) for t in tokens))
+        false_positives = sum(sketch.may_contain(str(i).encode())
+                              for i in range(1, 20000, 2))
+        self.assertLess(false_positives, 300)
+
+    def test_save_load(self):
+        with TemporaryDirectory() as tds:
+            file = Path(tds) / "data.txt"
+            file.write_text('alpha beta\ngamma\n')
+            lf = LinesFile(file)
+            lf.compress(sketch=True)
+            sketch = lf.load_sketch()
+            assert sketch is not None
+            self.assertTrue(sketch.may_contain(b'gamma'))
+            self.assertTrue(lf.may_contain_tokens([b'alpha', b'beta']))
+            self.assertFalse(lf.may_contain_tokens([b'alpha', b'delta']))